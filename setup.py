@@ -52,6 +52,11 @@ setup_args = {
         'nwb-extension',
         'ndx-extension'
     ],
+    'entry_points': {
+        'console_scripts': [
+            'ndx-structured-behavior=ndx_structured_behavior.convert:main',
+        ],
+    },
     'zip_safe': False
 }
 
@@ -27,7 +27,9 @@ TaskProgram = get_class('TaskProgram', 'ndx-structured-behavior')
 BEADLTaskProgram = get_class('BEADLTaskProgram', 'ndx-structured-behavior')
 from .trials_table import (EventsTable, StatesTable, TrialsTable, StateTypesTable, EventTypesTable,
                            ActionTypesTable, ActionsTable, data_program_validator)  # noqa: F401,E402
+from .trials_table import DataProgramValidation  # noqa: F401,E402
 from .task_argument_table import TaskArgumentsTable
+from .beadl_session import BeadlSession  # noqa: F401,E402
 
 # TaskRecording uses EventsTable, StatesTable, TrialsTable and so those classes must be registered
 # before TaskRecording is generated and registered
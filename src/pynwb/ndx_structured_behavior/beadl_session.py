@@ -0,0 +1,160 @@
+"""
+Module for loading the BeadlData of a session once and sharing it between the tables that are populated from it
+"""
+import numpy as np
+import pandas as pd
+from .utils import loadmat_records, record_value
+
+
+def _as_records(entry):
+    """
+    loadmat squeezes MATLAB struct arrays with a single element to a 0-d array and an empty
+    struct may be loaded as an empty array without fields. Return the entry as a 1D struct array
+    or None if it has no rows.
+    """
+    entry = np.atleast_1d(entry)
+    if entry.dtype.names is None or len(entry) == 0:
+        return None
+    return entry
+
+
+def _as_categorical(values):
+    """
+    Store names as integer codes and the unique names in order of first occurrence.
+    """
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+class _LazyColumns(dict):
+    """
+    The flat columns of a section of the BeadlData, e.g., the events of all trials.
+
+    Each column is decoded from the struct array of all rows only when it is accessed for the first time.
+    """
+
+    def __init__(self, records, fields, index):
+        super().__init__(index=index)
+        self._records = records  # 1D struct array with all rows, or None if there are no rows
+        self._fields = fields  # the column name mapped to the struct field and the decoder of the field
+
+    def __missing__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        field, decode = self._fields[key]
+        values = np.empty(0, dtype=object) if self._records is None else self._records[field]
+        self[key] = decode(values)
+        return self[key]
+
+
+def _section(trials, fields):
+    """
+    Concatenate the struct arrays of all trials into a single struct array.
+
+    trials: An array with the struct array of each trial
+    fields: A dict mapping the name of the column to the struct field and the decoder of the field
+
+    Returns the _LazyColumns with the 'index' with the (exclusive) end of the rows of each trial.
+    """
+    trial_records = [_as_records(trial) for trial in trials]
+    counts = [0 if records is None else len(records) for records in trial_records]
+    trial_records = [records for records in trial_records if records is not None]
+    records = np.concatenate(trial_records) if len(trial_records) > 0 else None
+    return _LazyColumns(records, fields, np.cumsum(counts, dtype=np.int64))
+
+
+def _as_float(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def _as_str(values):
+    return np.asarray([str(value) for value in values], dtype=object)
+
+
+class BeadlSession():
+    """
+    The data of a BEADL session, loaded once from the BeadlData of a matlab file.
+
+    The States, Events and StateOutputActions of all trials are stored as flat columns. Similar to a
+    VectorIndex, the 'index' of each section holds the (exclusive) end of the rows of each trial. All
+    times are relative to the start of their trial (see row_offsets). Names are stored as a pandas
+    Categorical and each column is decoded when it is first accessed.
+
+    Workflow:
+    session = BeadlSession.from_matlab(path='...')
+    events.populate_from_matlab(session=session)
+    states.populate_from_matlab(session=session)
+    """
+
+    def __init__(self, **kwargs):
+        self.trial_start_offset = np.asarray(kwargs['trial_start_offset'], dtype=np.float64)
+        self.states = kwargs['states']  # state_name, start_time, index
+        self.all_states = kwargs['all_states']  # state_name, index
+        self.events = kwargs['events']  # event_name, timestamp, value, index
+        self.actions = kwargs['actions']  # action_name, timestamp, value, index
+        self.arguments = kwargs.get('arguments', dict())
+        self.metadata = kwargs.get('metadata', dict())
+
+    @classmethod
+    def from_matlab(cls, path):
+        """
+        Parse the BeadlData from the matlab file at the given path.
+        """
+        matlab_file = loadmat_records(path)
+        return cls.from_beadl_data(matlab_file['BeadlData'])
+
+    @classmethod
+    def from_beadl_data(cls, beadl_data):
+        """
+        Convert the BeadlData struct returned by utils.loadmat_records to columns.
+        """
+        states_data = _as_records(record_value(beadl_data, 'States'))
+        events_data = _as_records(record_value(beadl_data, 'Events'))
+
+        states = _section(states_data['TrialPath'],
+                          {'state_name': ('stateName', _as_categorical),
+                           'start_time': ('stateStartTime', _as_float)})
+        all_states = _section(states_data['AllStatesList'],
+                              {'state_name': ('stateNames', _as_categorical)})
+        events = _section(events_data['AllEvents'],
+                          {'event_name': ('eventName', _as_categorical),
+                           'timestamp': ('eventTime', _as_float),
+                           'value': ('eventValue', _as_str)})
+        actions = _section(states_data['StateOutputActions'],
+                           {'action_name': ('actionName', _as_categorical),
+                            'timestamp': ('actionTime', _as_float),
+                            'value': ('actionValue', _as_str)})
+
+        session_metadata = record_value(beadl_data, 'SessionMetaData')
+        metadata = {name: record_value(session_metadata, name) for name in session_metadata.dtype.names}
+        beadl_arguments = record_value(beadl_data, 'BeadlArguments')
+        arguments = {name: np.atleast_1d(record_value(beadl_arguments, name))
+                     for name in beadl_arguments.dtype.names}
+
+        return cls(trial_start_offset=np.atleast_1d(metadata['TrialStartOffset']),
+                   states=states,
+                   all_states=all_states,
+                   events=events,
+                   actions=actions,
+                   arguments=arguments,
+                   metadata=metadata)
+
+    @property
+    def num_trials(self):
+        """
+        The number of trials in the session
+        """
+        return len(self.trial_start_offset)
+
+    def counts(self, section):
+        """
+        Return the number of rows in each trial for the given section, i.e., 'states', 'events' or 'actions'.
+        """
+        return np.diff(getattr(self, section)['index'], prepend=0)
+
+    def row_offsets(self, section):
+        """
+        Return the start offset of the trial of each row for the given section, i.e., 'states', 'events'
+        or 'actions'. Add this to the times of the section to get the time relative to the session start.
+        """
+        return np.repeat(self.trial_start_offset, self.counts(section))
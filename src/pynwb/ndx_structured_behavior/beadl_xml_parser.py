@@ -1,10 +1,32 @@
 import csv
 import requests
+import hashlib
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from types import MappingProxyType
+from collections import defaultdict, namedtuple, OrderedDict
 
 path = "/Users/mavaylon/Research/NWB/ndx-structured-behavior/src/pynwb/tests/Foraging_Task.xml"
 
+# The tags of the events and actions within the BeadlStates
+STATE_EVENT_TAGS = ('ExternalEvent', 'TimerEvent', 'ArgumentEvent', 'VariableEvent', 'TimeSpanEvent')
+STATE_ACTION_TAGS = ('OutputAction', 'SetVariableAction', 'CallbackAction')
+
+# The names of the states, events and actions and the arguments of a task program.
+# The names are unique and in order of first occurrence in the program. The arguments are read-only mappings
+# because the parsed programs are cached and shared by all tables of the same task program.
+ParsedBeadlProgram = namedtuple('ParsedBeadlProgram', ['states', 'events', 'actions', 'arguments'])
+
+PROGRAM_CACHE_SIZE = 32
+_program_cache = OrderedDict()  # sha256 of the program xml -> ParsedBeadlProgram, least recently used first
+
+
+def _unique(names):
+    """
+    Return the unique names in order of first occurrence.
+    """
+    return tuple(dict.fromkeys(names))
+
+
 class BeadlXMLParser():
     def __init__(self, **kwargs):
         # if kwargs['path'] is not None:
@@ -15,6 +37,7 @@ class BeadlXMLParser():
         self._root = ET.fromstring(kwargs['string'])
         self.version = self._beadl_version()
         self._protocal = self._establish_protocal()
+        self._build_indexes()
 
     # def _establish_root(self):
     #     """
@@ -36,6 +59,33 @@ class BeadlXMLParser():
 
         return list(self._root)[0]
 
+    def _build_indexes(self):
+        """
+        Helper function to index the top-level elements by tag and the states, events and actions
+        by name such that lookups do not search the tree.
+        """
+        self._elements = dict()
+        for child in self._protocal:
+            self._elements.setdefault(child.tag, child)  # the first match, the same as find
+
+        self._states = dict()
+        self._parsed_states = dict()
+        self._events = defaultdict(list)
+        self._actions = defaultdict(list)
+        states_element = self._elements.get('BeadlStates')
+        if states_element is not None:
+            for state in states_element.findall('BeadlState'):
+                self._states[state.attrib['name']] = state  # the last match, the same as before indexing
+            for child in states_element.iter():
+                if child.tag in STATE_EVENT_TAGS:
+                    self._events[child.attrib['eventName']].append(child.attrib)
+                elif child.tag in STATE_ACTION_TAGS:
+                    self._actions[child.attrib['actionName']].append(child.attrib)
+        events_element = self._elements.get('BeadlEvents')
+        if events_element is not None:
+            for event in events_element.iter('HardwareEvent'):
+                self._events[event.attrib['eventName']].append(event.attrib)
+
     def beadl_trial_protocal_attributes(self):
         """
         Return the name, starting state, and number of trials of the BeadlTrialProtocal
@@ -50,7 +100,7 @@ class BeadlXMLParser():
         """
 
         element_name = kwargs['element_name']
-        element = self._protocal.find(element_name)
+        element = self._elements.get(element_name)
 
         return element
 
@@ -100,8 +150,78 @@ class BeadlXMLParser():
             #     print(' '*(level+(int(len(element.tag)/2)))+'|---'+item+':',element.find(item).text)
 
     def retrieve_state_type(self, state_type):
-        states_element = self.element(element_name='BeadlStates').findall('BeadlState')
-        for states in states_element:
-            if states.attrib['name']==state_type:
-                parsed_child = self._parse_protocal_children(element=states)
-        return parsed_child
+        """
+        Return the parsed children of the BeadlState with the given name.
+        """
+        if state_type not in self._parsed_states:
+            if state_type not in self._states:
+                msg = "The state '%s' is not in the task program." % state_type
+                raise ValueError(msg)
+            self._parsed_states[state_type] = self._parse_protocal_children(element=self._states[state_type])
+        return self._parsed_states[state_type]
+
+    def retrieve_event_type(self, event_type):
+        """
+        Return the attributes of each HardwareEvent and each event within the states with the given name.
+        """
+        if event_type not in self._events:
+            msg = "The event '%s' is not in the task program." % event_type
+            raise ValueError(msg)
+        return self._events[event_type]
+
+    def retrieve_action_type(self, action_type):
+        """
+        Return the attributes of each action within the states with the given name.
+        """
+        if action_type not in self._actions:
+            msg = "The action '%s' is not in the task program." % action_type
+            raise ValueError(msg)
+        return self._actions[action_type]
+
+    def parse_program(self):
+        """
+        Extract the names of the states, events and actions and the arguments of the task program.
+        Each element is only parsed once.
+        """
+        parsed_states = self._parse_protocal_children(element=self.element(element_name='BeadlStates'))
+        parsed_events = self._parse_protocal_children(element=self.element(element_name='BeadlEvents'))
+        parsed_arguments = self._parse_protocal_children(element=self.element(element_name='BeadlArguments'))
+
+        events = list(parsed_events['HardwareEvent'])
+        for tag in STATE_EVENT_TAGS:
+            events += parsed_states[tag]
+        actions = []
+        for tag in STATE_ACTION_TAGS:
+            actions += parsed_states[tag]
+
+        return ParsedBeadlProgram(states=_unique(state['name'] for state in parsed_states['BeadlState']),
+                                  events=_unique(event['eventName'] for event in events),
+                                  actions=_unique(action['actionName'] for action in actions),
+                                  arguments=tuple(MappingProxyType(dict(arg))
+                                                  for arg in parsed_arguments['BeadlArgument']))
+
+
+def parse_beadl_program(string):
+    """
+    Return the ParsedBeadlProgram of the task program xml.
+
+    The result is cached by the sha256 of the xml such that tables and sessions that share a task program
+    only parse it once. The cache keeps the PROGRAM_CACHE_SIZE most recently used programs.
+    """
+    key = hashlib.sha256(string.encode('utf-8')).hexdigest()
+    parsed = _program_cache.get(key)
+    if parsed is None:
+        parsed = BeadlXMLParser(string=string).parse_program()
+        _program_cache[key] = parsed
+        while len(_program_cache) > PROGRAM_CACHE_SIZE:
+            _program_cache.popitem(last=False)
+    else:
+        _program_cache.move_to_end(key)
+    return parsed
+
+
+def clear_program_cache():
+    """
+    Remove all parsed task programs from the cache of parse_beadl_program.
+    """
+    _program_cache.clear()
@@ -0,0 +1,238 @@
+"""
+Command line tool for converting directories of BEADL sessions to NWB files
+
+Usage:
+ndx-structured-behavior convert <directory> --jobs 4
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from pynwb import NWBHDF5IO
+from pynwb.file import NWBFile, Subject
+from ndx_structured_behavior import (Task, TaskRecording, BEADLTaskProgram, BEADLTaskSchema, EventTypesTable,
+                                     EventsTable, StateTypesTable, StatesTable, TrialsTable, ActionTypesTable,
+                                     ActionsTable, TaskArgumentsTable, BeadlSession)
+
+# The files of a BEADL session: the BeadlData .mat file, the task program .xml and the task schema .xsd
+BeadlSessionFiles = namedtuple('BeadlSessionFiles', ['data', 'program', 'schema'])
+
+# The result of converting a session. error is None if the conversion succeeded.
+ConversionResult = namedtuple('ConversionResult', ['files', 'nwb_path', 'error', 'seconds'])
+
+
+def _match_file(directory, stem, files, extension):
+    """
+    Return the file with the same name as the .mat file and the given extension or else the only file with the
+    extension in the directory.
+    """
+    if stem + extension in files:
+        return os.path.join(directory, stem + extension)
+    candidates = [name for name in files if name.endswith(extension)]
+    if len(candidates) == 1:
+        return os.path.join(directory, candidates[0])
+    return None
+
+
+def find_sessions(directory):
+    """
+    Find the (.mat, .xml, .xsd) triplets in the directory and its subdirectories.
+
+    The task program and schema of a .mat file are the .xml and .xsd files with the same name or else the only
+    .xml and .xsd files in the same directory, e.g., when all sessions in the directory share a task program.
+    Returns a list of BeadlSessionFiles and a list of the .mat files without a task program or schema.
+    """
+    sessions = []
+    unmatched = []
+    for root, _, files in sorted(os.walk(directory)):
+        files = sorted(files)
+        for name in files:
+            if not name.endswith('.mat'):
+                continue
+            stem = name[:-len('.mat')]
+            program = _match_file(root, stem, files, '.xml')
+            schema = _match_file(root, stem, files, '.xsd')
+            if program is None or schema is None:
+                unmatched.append(os.path.join(root, name))
+            else:
+                sessions.append(BeadlSessionFiles(data=os.path.join(root, name), program=program, schema=schema))
+    return sessions, unmatched
+
+
+def convert_session(files, nwb_path, encode_values=False):
+    """
+    Convert a BEADL session to an NWB file, the same as tests/example.py.
+
+    The file is written to a temporary path next to nwb_path and renamed when it is complete, such that a failed
+    conversion does not leave a partial NWB file that is skipped by later runs. All tables are written with
+    configure_dataio(appendable=True), such that trials can be appended to the file.
+
+    encode_values: Store the values of the events and actions as integer codes, see EventsTable
+    """
+    with open(files.schema, 'r') as xsd_file:
+        xsd = xsd_file.read()
+    with open(files.program, 'r') as xml_file:
+        xml = xml_file.read()
+
+    beadl_task_schema = BEADLTaskSchema(name='task_schema', data=xsd, version='0.1.0', language='XSD')
+    beadl_task_program = BEADLTaskProgram(name='task_program', data=xml, schema=beadl_task_schema, language='XML')
+
+    task_arg_table = TaskArgumentsTable(beadl_task_program=beadl_task_program, populate_from_program=True)
+    event_types = EventTypesTable(description='description', beadl_task_program=beadl_task_program,
+                                  populate_from_program=True)
+    action_types = ActionTypesTable(description='description', beadl_task_program=beadl_task_program,
+                                    populate_from_program=True)
+    state_types = StateTypesTable(description='description', beadl_task_program=beadl_task_program,
+                                  populate_from_program=True)
+    task = Task(task_program=beadl_task_program, task_schema=beadl_task_schema, event_types=event_types,
+                state_types=state_types, action_types=action_types, task_arguments=task_arg_table)
+
+    session = BeadlSession.from_matlab(files.data)
+    events = EventsTable(description='description', event_types_table=event_types, encode_values=encode_values)
+    events.populate_from_matlab(session=session)
+    actions = ActionsTable(description='description', action_types_table=action_types,
+                           encode_values=encode_values)
+    actions.populate_from_matlab(session=session)
+    states = StatesTable(description='description', state_types_table=state_types)
+    states.populate_from_matlab(session=session)
+    trials = TrialsTable(description='description', states_table=states, events_table=events, actions_table=actions)
+    trials.populate_from_matlab(session=session)
+
+    metadata = session.metadata
+    identifier = os.path.splitext(os.path.basename(files.data))[0]
+    if 'SessionStartTimestamp' in metadata:
+        session_start_time = datetime.datetime.fromtimestamp(metadata['SessionStartTimestamp'], datetime.timezone.utc)
+    else:
+        session_start_time = datetime.datetime.now(datetime.timezone.utc)
+    nwbfile = NWBFile(
+        session_description=str(metadata.get('SessionName', identifier)),
+        identifier=identifier,
+        session_start_time=session_start_time,
+        subject=Subject(subject_id=str(metadata['SbjectName'])) if 'SbjectName' in metadata else None,
+    )
+    for table in (events, actions, states, trials):
+        table.configure_dataio(appendable=True)
+
+    nwbfile.add_lab_meta_data(task)
+    nwbfile.add_acquisition(TaskRecording(events=events, states=states, actions=actions))
+    nwbfile.trials = trials
+
+    tmp_path = nwb_path + '.tmp'  # in the same directory, such that os.replace is atomic
+    try:
+        with NWBHDF5IO(tmp_path, mode='w') as io:
+            io.write(nwbfile)
+        os.replace(tmp_path, nwb_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return nwb_path
+
+
+def _convert_worker(files, nwb_path, encode_values):
+    """
+    Convert a session and return a ConversionResult. Errors are returned instead of raised such that one
+    broken session does not stop the conversion of the other sessions.
+    """
+    start = time.perf_counter()
+    try:
+        convert_session(files, nwb_path, encode_values=encode_values)
+        error = None
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    return ConversionResult(files=files, nwb_path=nwb_path, error=error, seconds=time.perf_counter() - start)
+
+
+def convert_directory(directory, output_dir=None, jobs=1, overwrite=False, encode_values=False, log=print):
+    """
+    Convert all BEADL sessions in the directory to NWB files.
+
+    directory: The directory with the (.mat, .xml, .xsd) files of the sessions
+    output_dir: The directory for the NWB files. By default, each NWB file is written next to its .mat file.
+    jobs: The number of processes used for the conversion
+    overwrite: Convert sessions that already have an NWB file
+    encode_values: Store the values of the events and actions as integer codes
+    log: Function called with the progress messages
+
+    Returns the list of ConversionResult of the converted sessions.
+    """
+    sessions, unmatched = find_sessions(directory)
+    for path in unmatched:
+        log('Skipping %s: no task program (.xml) or task schema (.xsd) found' % path)
+
+    tasks = []
+    for files in sessions:
+        stem = os.path.splitext(os.path.basename(files.data))[0]
+        nwb_dir = os.path.dirname(files.data) if output_dir is None else output_dir
+        nwb_path = os.path.join(nwb_dir, stem + '.nwb')
+        if not overwrite and os.path.exists(nwb_path):
+            log('Skipping %s: %s exists' % (files.data, nwb_path))
+            continue
+        tasks.append((files, nwb_path))
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    start = time.perf_counter()
+    input_bytes = 0
+
+    def _report(result):
+        nonlocal input_bytes
+        results.append(result)
+        input_bytes += os.path.getsize(result.files.data)
+        elapsed = time.perf_counter() - start
+        status = 'ok' if result.error is None else 'FAILED (%s)' % result.error
+        log('[%i/%i] %s %s in %.2f s (%.2f sessions/s, %.2f MB/s)'
+            % (len(results), len(tasks), result.files.data, status, result.seconds,
+               len(results) / elapsed, input_bytes / 1e6 / elapsed))
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_convert_worker, files, nwb_path, encode_values): (files, nwb_path)
+                       for files, nwb_path in tasks}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # a worker process died, e.g., killed by the OS when out of memory
+                    files, nwb_path = futures[future]
+                    result = ConversionResult(files=files, nwb_path=nwb_path, error='%s: %s' % (type(e).__name__, e),
+                                              seconds=0.0)
+                _report(result)
+    else:
+        for files, nwb_path in tasks:
+            _report(_convert_worker(files, nwb_path, encode_values))
+
+    num_failed = sum(result.error is not None for result in results)
+    log('Converted %i of %i sessions in %.2f s'
+        % (len(results) - num_failed, len(results), time.perf_counter() - start))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ndx-structured-behavior',
+                                     description='Tools for the ndx-structured-behavior extension.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='Convert a directory of BEADL sessions to NWB files.')
+    convert_parser.add_argument('directory', help='The directory with the .mat, .xml and .xsd files of the sessions.')
+    convert_parser.add_argument('--output-dir', default=None,
+                                help='The directory for the NWB files. By default, next to each .mat file.')
+    convert_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                                help='The number of processes used for the conversion. (Default: the number of CPUs)')
+    convert_parser.add_argument('--overwrite', action='store_true', help='Convert sessions that have an NWB file.')
+    convert_parser.add_argument('--encode-values', action='store_true',
+                                help='Store the values of the events and actions as integer codes.')
+    args = parser.parse_args(argv)
+
+    results = convert_directory(args.directory, output_dir=args.output_dir, jobs=args.jobs,
+                                overwrite=args.overwrite, encode_values=args.encode_values)
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
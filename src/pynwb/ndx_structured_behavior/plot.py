@@ -8,6 +8,8 @@ import networkx as nx
 import numpy as np
 from typing import Union
 import warnings
+from collections import OrderedDict
+from hdmf.common.table import EnumData
 from ndx_structured_behavior import (EventsTable, EventTypesTable,
                        ActionsTable, ActionTypesTable,
                        StatesTable, StateTypesTable,
@@ -18,24 +20,101 @@ def show_by_type_and_value(table: Union[ActionsTable, EventsTable, pd.DataFrame]
                            show_table_values: bool = True,
                            y_offset: float = 0,
                            ): # events and actions
-        df = table.to_dataframe(index=True) if not isinstance(table, pd.DataFrame) else table
-        type_name = 'event_name' if isinstance(table_types, EventTypesTable) else 'action_name'
-        type_column = 'event_type' if isinstance(table_types, EventTypesTable) else 'action_type'
-        x_values = df['timestamp'][:]
-        y_label = "Event type" if isinstance(table_types, EventTypesTable) else 'Action type'
-        # show table by type and value
-        if show_table_values:
-            table_types_loaded = table_types[type_name][:]
-            table_and_values_merged = list(zip([table_types_loaded[i] for i in df[type_column][:]], df['value'][:]))
-            table_types_and_values = list(set(table_and_values_merged))
-            y_values = [table_types_and_values.index(ev) + y_offset for ev in table_and_values_merged]
-            y_tick_labels = ["%s(%s)" % v for v in table_types_and_values]
-        # Show events by type
+    """
+    Compute the row along the y axis of each event or action, by type and value or by type only.
+
+    The (type, value) pairs are ordered by the index of the type and then by the value, such that the
+    labels are the same each time. The pairs are encoded as integers and labelled with a single np.unique.
+
+    :return: Tuple with the y value of each row, the y tick labels, and the y label
+    """
+    type_name = 'event_name' if isinstance(table_types, EventTypesTable) else 'action_name'
+    type_column = 'event_type' if isinstance(table_types, EventTypesTable) else 'action_type'
+    y_label = "Event type" if isinstance(table_types, EventTypesTable) else 'Action type'
+    if isinstance(table, pd.DataFrame):
+        types = np.asarray(table[type_column], dtype=np.int64)
+    else:
+        types = np.asarray(table[type_column].data[:], dtype=np.int64)
+    # show table by type and value
+    if show_table_values:
+        if isinstance(table, pd.DataFrame):
+            values = table['value']
+        elif isinstance(table['value'], EnumData):
+            values = pd.Categorical.from_codes(np.asarray(table['value'].data[:], dtype=np.int64),
+                                               categories=pd.Index(table['value'].elements.data[:]))
         else:
-            y_values = np.asarray(df[type_column][:]) + y_offset
-            y_tick_labels = table_types[type_name][:]
+            values = np.asarray(table['value'].data[:], dtype=object)
+        value_codes, value_names = pd.factorize(values, sort=True)
+        type_names = np.asarray(table_types[type_name][:], dtype=object)
+        value_names = np.asarray(value_names, dtype=object)
+        pairs, y_values = np.unique(types * len(value_names) + value_codes, return_inverse=True)
+        y_values = y_values + y_offset
+        y_tick_labels = ["%s(%s)" % (type_names[pair // len(value_names)], value_names[pair % len(value_names)])
+                         for pair in pairs]
+    # Show events by type
+    else:
+        y_values = types + y_offset
+        y_tick_labels = table_types[type_name][:]
+
+    return y_values, y_tick_labels, y_label
+
+
+# Above this number of rows, plot_events and plot_actions draw density strips instead of one marker per row
+DEFAULT_MAX_MARKERS = 100000
+
+
+def plot_markers(x_values, y_values,
+                 marker: str = None,
+                 marker_size: int = None,
+                 marker_width: int = None,
+                 marker_color=None,
+                 max_markers: int = DEFAULT_MAX_MARKERS,
+                 num_bins: int = None):
+    """
+    Plot a tick for each (x, y) value or, if there are more than max_markers values, a density strip for each y value.
+
+    The density strips count the values of each row (y value) in time bins with np.bincount and draw the
+    counts as a single mesh, which renders in constant time regardless of the number of values.
+
+    :param x_values: The times of the markers
+    :param y_values: The integer row of each marker, e.g., from show_by_type_and_value
+    :param marker: String marker to use in scatter plot. (Default="|")
+    :param max_markers: Draw density strips if there are more values than this. (Default=DEFAULT_MAX_MARKERS)
+    :param num_bins: The number of time bins of the density strips. (Default=None, i.e., the width of the axes
+                     in pixels)
+
+    :return: The matplotlib artist, i.e., the PathCollection of the markers or the QuadMesh of the density strips
+    """
+    x_values = np.asarray(x_values, dtype=np.float64)
+    if len(x_values) <= max_markers:
+        return plt.scatter(x_values,
+                           y_values,
+                           marker='|' if marker is None else marker,
+                           s=marker_size,
+                           linewidth=marker_width,
+                           color=marker_color)
+    ax = plt.gca()
+    if num_bins is None:
+        num_bins = max(int(ax.get_window_extent().width), 1)
+    rows = np.rint(np.asarray(y_values)).astype(np.int64)
+    first_row = rows.min()
+    rows -= first_row
+    num_rows = int(rows.max()) + 1
+    x_min, x_max = x_values.min(), x_values.max()
+    if x_max == x_min:
+        x_max = x_min + 1
+    bins = ((x_values - x_min) * (num_bins / (x_max - x_min))).astype(np.int64)
+    np.clip(bins, 0, num_bins - 1, out=bins)
+    counts = np.bincount(rows * num_bins + bins, minlength=num_rows * num_bins).reshape(num_rows, num_bins)
+    cmap = 'Greys' if marker_color is None else mpl.colors.LinearSegmentedColormap.from_list(
+        'density', ['white', marker_color])
+    return ax.pcolormesh(np.linspace(x_min, x_max, num_bins + 1),
+                         np.arange(num_rows + 1) + first_row - 0.5,
+                         np.ma.masked_equal(counts, 0),
+                         cmap=cmap,
+                         norm=mpl.colors.LogNorm(vmin=1, vmax=max(counts.max(), 1)),
+                         shading='flat')
 
-        return y_values, y_tick_labels, y_label
 
 def plot_events(events: Union[EventsTable, pd.DataFrame],
                 event_types: EventTypesTable,
@@ -48,7 +127,9 @@ def plot_events(events: Union[EventsTable, pd.DataFrame],
                 marker_color=None,
                 y_offset: float = 0,
                 keep_yticks: bool = False,
-                fig=None):
+                fig=None,
+                max_markers: int = DEFAULT_MAX_MARKERS,
+                num_bins: int = None):
     """
     Plot a tick plot showing the times of events.
 
@@ -64,23 +145,30 @@ def plot_events(events: Union[EventsTable, pd.DataFrame],
                      keep the text and location of existing ytick labels. (Default=False)
     :param fig: Matplotlib figure. If None then create a new figure, otherwise assume that a figure exists.
                 (Default=None, i.e., create a new figure)
+    :param max_markers: Above this number of events, draw a density strip for each row instead of a marker
+                for each event, see plot_markers. (Default=DEFAULT_MAX_MARKERS)
+    :param num_bins: The number of time bins of the density strips. (Default=None, i.e., one bin per pixel)
 
     :return: Matplotlib figure. Call plt.show() to render the figure.
     """
-    edf = events.to_dataframe(index=True) if not isinstance(events, pd.DataFrame) else events
-    x_values = edf['timestamp'][:]
+    # read only the timestamps instead of converting all columns of the table to a DataFrame
+    if isinstance(events, pd.DataFrame):
+        x_values = events['timestamp'].to_numpy()
+    else:
+        x_values = np.asarray(events['timestamp'].data[:])
     # show events by type and value
     y_values, y_tick_labels, y_label = show_by_type_and_value(table=events, table_types=event_types)
 
     if fig is None:
         fig = plt.figure(figsize=(18, 3) if figsize is None else figsize)
-    plt.scatter(
-        x_values,
-        y_values,
-        marker='|' if marker is None else marker,
-        s=marker_size,
-        linewidth=marker_width,
-        color=marker_color)
+    plot_markers(x_values,
+                 y_values,
+                 marker=marker,
+                 marker_size=marker_size,
+                 marker_width=marker_width,
+                 marker_color=marker_color,
+                 max_markers=max_markers,
+                 num_bins=num_bins)
     plt.xlabel('Time in seconds (s)', fontsize=fontsize)
     plt.xticks(fontsize=fontsize)
     if keep_yticks:
@@ -106,7 +194,9 @@ def plot_actions(actions: Union[ActionsTable, pd.DataFrame],
                  marker_color=None,
                  y_offset: float = 0,
                  keep_yticks: bool = False,
-                 fig=None):
+                 fig=None,
+                 max_markers: int = DEFAULT_MAX_MARKERS,
+                 num_bins: int = None):
     """
     Plot a tick plot showing the times of actions.
 
@@ -122,21 +212,29 @@ def plot_actions(actions: Union[ActionsTable, pd.DataFrame],
                      keep the text and location of existing ytick labels. (Default=False)
     :param fig: Matplotlib figure. If None then create a new figure, otherwise assume that a figure exists.
                 (Default=None, i.e., create a new figure)
+    :param max_markers: Above this number of actions, draw a density strip for each row instead of a marker
+                for each action, see plot_markers. (Default=DEFAULT_MAX_MARKERS)
+    :param num_bins: The number of time bins of the density strips. (Default=None, i.e., one bin per pixel)
 
     :return: Matplotlib figure. Call plt.show() to render the figure.
     """
-    adf = actions.to_dataframe(index=True) if not isinstance(actions, pd.DataFrame) else actions
-    x_values = adf['timestamp'][:]
+    # read only the timestamps instead of converting all columns of the table to a DataFrame
+    if isinstance(actions, pd.DataFrame):
+        x_values = actions['timestamp'].to_numpy()
+    else:
+        x_values = np.asarray(actions['timestamp'].data[:])
     # show events by type and value
     y_values, y_tick_labels, y_label = show_by_type_and_value(table=actions, table_types=action_types)
     if fig is None:
         fig = plt.figure(figsize=(18, 3) if figsize is None else figsize)
-    plt.scatter(x_values,
-                np.asarray(y_values) + y_offset,
-                marker='|' if marker is None else marker,
-                s=marker_size,
-                linewidth=marker_width,
-                color=marker_color)
+    plot_markers(x_values,
+                 np.asarray(y_values) + y_offset,
+                 marker=marker,
+                 marker_size=marker_size,
+                 marker_width=marker_width,
+                 marker_color=marker_color,
+                 max_markers=max_markers,
+                 num_bins=num_bins)
     plt.xlabel('Time in seconds (s)', fontsize=fontsize)
     plt.xticks(fontsize=fontsize)
     if keep_yticks:
@@ -253,7 +351,8 @@ def plot_trials(trials: Union[TrialsTable, pd.DataFrame],
                 figsize=None,
                 fontsize=18,
                 rectangle_height=1,
-                marker_size=None):
+                marker_size=None,
+                trial_range: tuple = None):
     """
    Plot the event, actions, states, and trial times for one or more trials
 
@@ -271,15 +370,30 @@ def plot_trials(trials: Union[TrialsTable, pd.DataFrame],
    :param rectangle_height: Height of the rectangles along the y-axis. This should normally be
                              between 0 and 1. (Default=1)
    :param marker_size: Height size for scatter plot markers for instantaneous acions/events/tates. (Default=None):
+   :param trial_range: Tuple (start, stop) with the range of trials to plot, i.e., the positions of the trials in
+                       the TrialsTable or the DataFrame. For a TrialsTable, only the offsets of these trials and
+                       their rows of the states, events and actions are read, which avoids reading the whole tables
+                       from a file. (Default=None, i.e., plot all trials)
 
    :return: Matplotlib figure. Call plt.show() to render the figure.
     """
+    if isinstance(trials, pd.DataFrame):
+        trials_df = trials if trial_range is None else trials.iloc[trial_range[0]:trial_range[1]]
+        events_df = events[[j for i in trials_df["events"] for j in i]]
+        actions_df = actions[[j for i in trials_df["actions"] for j in i]]
+        states_df = states[[j for i in trials_df["states"] for j in i]]
+    else:
+        start, stop = (0, len(trials)) if trial_range is None else trial_range
+        trials_df = pd.DataFrame({'start_time': trials['start_time'].data[start:stop],
+                                  'stop_time': trials['stop_time'].data[start:stop]},
+                                 index=pd.Index(trials.id.data[start:stop], name='id'))
+        events_df = events[trials.trial_events(trial=start, stop=stop, df=False)]
+        actions_df = actions[trials.trial_actions(trial=start, stop=stop, df=False)]
+        states_df = states[trials.trial_states(trial=start, stop=stop, df=False)]
 
-    trials_df = trials if isinstance(trials, pd.DataFrame) else trials.to_dataframe(index=True)
     fig = plt.figure(figsize=(18, 10) if figsize is None else figsize)
-    events_index = [j for i in trials_df["events"] for j in i]
-    if len(events_index) > 0:
-        plot_events(events=events[events_index],
+    if len(events_df) > 0:
+        plot_events(events=events_df,
                     event_types=event_types,
                     show_event_values=True,
                     marker_size=marker_size,
@@ -288,12 +402,11 @@ def plot_trials(trials: Union[TrialsTable, pd.DataFrame],
                     y_offset=0,
                     fontsize=fontsize,
                     fig=fig)
-    actions_index = [j for i in trials_df["actions"] for j in i]
     y_offset = np.ceil(plt.ylim()[1])
     if y_offset == plt.ylim()[1]:
         y_offset += 1
-    if len(actions_index) > 0:
-        plot_actions(actions=actions[actions_index],
+    if len(actions_df) > 0:
+        plot_actions(actions=actions_df,
                      action_types=action_types,
                      show_action_values=True,
                      marker_size=marker_size,
@@ -303,12 +416,11 @@ def plot_trials(trials: Union[TrialsTable, pd.DataFrame],
                      keep_yticks=True,
                      fontsize=fontsize,
                      fig=fig)
-    states_index = [j for i in trials_df["states"] for j in i]
     y_offset = np.ceil(plt.ylim()[1])
     if y_offset == plt.ylim()[1]:
         y_offset += 1
-    if len(states_index) > 0 :
-        plot_states(states=states[states_index],
+    if len(states_df) > 0 :
+        plot_states(states=states_df,
                     state_types=state_types,
                     y_offset=y_offset,
                     rectangle_height=1,
@@ -348,34 +460,321 @@ def plot_trials(trials: Union[TrialsTable, pd.DataFrame],
     return fig
 
 
+def _state_trials(trials: TrialsTable):
+    """
+    Return the index of the trial of each row of the StatesTable, or -1 if the row is in no trial.
+    """
+    counts = np.diff(np.asarray(trials.states_index.data[:], dtype=np.int64), prepend=0)
+    state_trials = np.full(len(trials.states.table), -1, dtype=np.int64)
+    state_trials[np.asarray(trials.states.data[:], dtype=np.int64)] = np.repeat(np.arange(len(counts)), counts)
+    return state_trials
+
+
+def _state_sequence(states: Union[StatesTable, pd.DataFrame], trials: TrialsTable = None):
+    """
+    Return the state types ordered by start_time and, if trials is given, the index of the trial of each
+    state or -1 if the state is in no trial.
+    """
+    if isinstance(states, pd.DataFrame):
+        start_times = np.asarray(states['start_time'], dtype=np.float64)
+        state_sequence = np.asarray(states['state_type'], dtype=np.int64)
+        rows = np.asarray(states.index, dtype=np.int64)
+    else:
+        start_times = np.asarray(states['start_time'].data[:], dtype=np.float64)
+        state_sequence = np.asarray(states['state_type'].data[:], dtype=np.int64)
+        rows = np.arange(len(state_sequence))
+    if not np.all(start_times[1:] >= start_times[:-1]):
+        order = np.argsort(start_times, kind='stable')
+        state_sequence = state_sequence[order]
+        rows = rows[order]
+    state_trials = None if trials is None else _state_trials(trials)[rows]
+    return state_sequence, state_trials
+
+
+def _transition_matrices(counts, state_names, sparse):
+    """
+    Return the counts of transitions between states as a K x K matrix and the corresponding transition
+    probabilities, as DataFrames or as scipy.sparse CSR matrices.
+    """
+    row_sums = np.asarray(counts.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros(len(row_sums)), where=row_sums > 0)
+    if sparse:
+        from scipy.sparse import diags
+        return counts, (diags(scale) @ counts).tocsr()
+    count_df = pd.DataFrame(
+        data=counts,
+        index=pd.Index(data=state_names, name='from'),
+        columns=pd.Index(data=state_names, name='to'))
+    probability_df = pd.DataFrame(
+        data=counts * scale[:, np.newaxis],
+        index=count_df.index,
+        columns=count_df.columns)
+    return count_df, probability_df
+
+
 def compute_state_transition_matrix(states: Union[StatesTable, pd.DataFrame],
-                                    state_types: StateTypesTable):
+                                    state_types: StateTypesTable,
+                                    trials: TrialsTable = None,
+                                    blocks=None,
+                                    sparse: bool = False):
     """
     Given a sequence of states compute the matrix with the transition counts and probabilities
 
+    The states are ordered by start_time and each transition is encoded as from * K + to for K state types,
+    such that all transitions are counted with a single np.bincount.
+
     :param states: The StatesTable with the sequence of transitions
     :param state_types: The StatesTypesTable with the list of types
+    :param trials: The TrialsTable with the states of each trial. If given, transitions between the last state
+                   of a trial and the first state of the next trial are not counted. (Default=None)
+    :param blocks: The name of a column of the TrialsTable or an array with the block of each trial. If given,
+                   the transitions are counted separately for each block. Requires trials. (Default=None)
+    :param sparse: Return scipy.sparse CSR matrices instead of DataFrames, e.g., for large sets of state types.
+                   (Default=False)
 
     :return: Tuple with a pandas DataFrame defining the counts of transitions between states and
-             a DataFrame with the corresponding transition probabilities
+             a DataFrame with the corresponding transition probabilities. If blocks is given, a dict
+             mapping each block to such a tuple.
     """
     num_states = len(state_types)
-    state_transition_count = np.zeros(shape=(num_states, num_states), dtype=int)
-    sdf = states if isinstance(states, pd.DataFrame) else states.to_dataframe(index=True)
-    sdf = sdf.sort_values(by='start_time')  # the for loop to count state transitions assumes states are sorted
-    state_sequence = sdf['state_type'].to_numpy()
-    for (i, j) in zip(state_sequence, state_sequence[1:]):
-        state_transition_count[i][j] += 1
-    state_transition_count_df = pd.DataFrame(
-        data=state_transition_count,
-        index=pd.Index(data=state_types['state_name'][:], name='from'),
-        columns=pd.Index(data=state_types['state_name'][:], name='to'))
-    state_transition_probability_df = state_transition_count_df.divide(
-        state_transition_count_df.sum(axis='columns'),
-        axis='rows')
-    state_transition_probability_df[state_transition_probability_df.isnull()] = 0
-
-    return state_transition_count_df, state_transition_probability_df
+    state_names = state_types['state_name'][:]
+    if blocks is not None and trials is None:
+        msg = "Counting transitions per block requires the TrialsTable ('trials')."
+        raise ValueError(msg)
+    state_sequence, state_trials = _state_sequence(states, trials)
+    transitions = state_sequence[:-1] * num_states + state_sequence[1:]
+
+    if trials is not None:
+        within_trial = (state_trials[:-1] == state_trials[1:]) & (state_trials[:-1] >= 0)
+        transitions = transitions[within_trial]
+        transition_trials = state_trials[:-1][within_trial]
+
+    if blocks is None:
+        groups = np.zeros(len(transitions), dtype=np.int64)
+        block_names = [None]
+    else:
+        trial_blocks = np.asarray(trials[blocks].data[:] if isinstance(blocks, str) else blocks)
+        if len(trial_blocks) != len(trials):
+            msg = "'blocks' has %i values but the TrialsTable has %i trials." % (len(trial_blocks), len(trials))
+            raise ValueError(msg)
+        block_codes, block_names = pd.factorize(trial_blocks, sort=True)
+        block_names = block_names.tolist()
+        groups = block_codes[transition_trials]
+
+    num_transitions = num_states * num_states
+    if sparse:
+        from scipy.sparse import csr_matrix
+        codes, code_counts = np.unique(groups * num_transitions + transitions, return_counts=True)
+        matrices = [csr_matrix((code_counts[codes // num_transitions == group],
+                                divmod(codes[codes // num_transitions == group] % num_transitions, num_states)),
+                               shape=(num_states, num_states))
+                    for group in range(len(block_names))]
+    else:
+        counts = np.bincount(groups * num_transitions + transitions, minlength=len(block_names) * num_transitions)
+        matrices = counts.reshape(len(block_names), num_states, num_states)
+
+    results = [_transition_matrices(matrix, state_names, sparse) for matrix in matrices]
+    if blocks is None:
+        return results[0]
+    return dict(zip(block_names, results))
+
+
+def compute_state_ngrams(states: Union[StatesTable, pd.DataFrame],
+                         state_types: StateTypesTable,
+                         n: int = 2,
+                         trials: TrialsTable = None,
+                         per_trial: bool = False,
+                         sparse: bool = False):
+    """
+    Count the sequences of n consecutive states (n-grams), i.e., the transitions of order n - 1.
+
+    Each n-gram is encoded as the integer sum(state_j * K ** (n - 1 - j)) for K state types, computed with
+    one rolling multiply-add per position, and the codes are counted with np.unique. Only the n-grams that
+    occur are stored.
+
+    :param states: The StatesTable with the sequence of states
+    :param state_types: The StatesTypesTable with the list of types
+    :param n: The number of states of each sequence. n=2 counts the transitions between states. (Default=2)
+    :param trials: The TrialsTable with the states of each trial. If given, sequences that span more than one
+                   trial are not counted. (Default=None)
+    :param per_trial: Count the sequences of each trial separately. Requires trials. (Default=False)
+    :param sparse: Return a scipy.sparse CSR matrix instead of a dict. The rows are the codes of the first
+                   n - 1 states and the columns the last state, or, with per_trial, the rows are the trials and
+                   the columns the codes of the n-grams. (Default=False)
+
+    :return: A dict mapping each n-gram, a tuple of state names, to its count, or, with per_trial, a dict
+             mapping the index of each trial to such a dict. If sparse, the CSR matrix.
+    """
+    num_states = len(state_types)
+    if n < 1:
+        msg = "'n' must be at least 1, got %i." % n
+        raise ValueError(msg)
+    if per_trial and trials is None:
+        msg = "Counting sequences per trial requires the TrialsTable ('trials')."
+        raise ValueError(msg)
+    num_codes = num_states ** n
+    num_groups = len(trials) if per_trial else 1
+    if num_groups * num_codes > np.iinfo(np.int64).max:
+        msg = 'Cannot encode sequences of %i states of %i state types as 64-bit integers.' % (n, num_states)
+        raise ValueError(msg)
+
+    state_sequence, state_trials = _state_sequence(states, trials)
+    num_ngrams = max(len(state_sequence) - n + 1, 0)
+    codes = np.zeros(num_ngrams, dtype=np.int64)
+    for j in range(n):
+        codes = codes * num_states + state_sequence[j:j + num_ngrams]
+    if trials is not None:
+        ngram_trials = state_trials[:num_ngrams]
+        within_trial = ngram_trials >= 0
+        for j in range(1, n):
+            within_trial &= state_trials[j:j + num_ngrams] == ngram_trials
+        codes = codes[within_trial]
+        ngram_trials = ngram_trials[within_trial]
+    groups = ngram_trials if per_trial else np.zeros(len(codes), dtype=np.int64)
+
+    keys, counts = np.unique(groups * num_codes + codes, return_counts=True)
+    groups, codes = np.divmod(keys, num_codes)
+    if sparse:
+        from scipy.sparse import csr_matrix
+        if per_trial:
+            return csr_matrix((counts, (groups, codes)), shape=(num_groups, num_codes))
+        return csr_matrix((counts, np.divmod(codes, num_states)), shape=(num_codes // num_states, num_states))
+
+    state_names = np.asarray(state_types['state_name'][:], dtype=object)
+    ngrams = zip(*(state_names[positions] for positions in np.unravel_index(codes, (num_states,) * n)))
+    if not per_trial:
+        return dict(zip(ngrams, counts.tolist()))
+    trial_ngrams = {trial: dict() for trial in range(num_groups)}
+    for trial, ngram, count in zip(groups.tolist(), ngrams, counts.tolist()):
+        trial_ngrams[trial][ngram] = count
+    return trial_ngrams
+
+
+class StateTransitionAccumulator():
+    """
+    Count the transitions between states incrementally as states are appended, e.g., during a live session.
+
+    The counts are updated in O(1) per state. The states are assumed to be appended in the order of their
+    start_time. Attach the accumulator to a StatesTable to count the rows added with add_row or add_rows.
+
+    Workflow:
+    accumulator = StateTransitionAccumulator(state_types=state_types, states=states)
+    states.add_state(state_type=0, start_time=0.0, stop_time=0.1)
+    counts, probabilities = accumulator.get_matrices()
+    """
+
+    def __init__(self, state_types: StateTypesTable, states: StatesTable = None):
+        """
+        :param state_types: The StateTypesTable with the list of types
+        :param states: The StatesTable to attach to. Its existing rows are counted. (Default=None)
+        """
+        self.state_types = state_types
+        self.counts = np.zeros((len(state_types), len(state_types)), dtype=np.int64)
+        self.last_state = None  # the type of the last state or None at the start of a sequence
+        self.states = None
+        if states is not None:
+            self.attach(states)
+
+    def attach(self, states: StatesTable):
+        """
+        Count the existing rows of the StatesTable and the rows that are added to it.
+        """
+        if self.states is not None:
+            msg = 'The accumulator is already attached to a StatesTable.'
+            raise ValueError(msg)
+        self.update(np.asarray(states['state_type'].data[:], dtype=np.int64))
+        states.add_listener(self.update)
+        self.states = states
+
+    def detach(self):
+        """
+        Stop counting the rows that are added to the attached StatesTable.
+        """
+        if self.states is not None:
+            self.states.remove_listener(self.update)
+            self.states = None
+
+    def update(self, state_types):
+        """
+        Count the transitions into each of the given states, which follow the last state counted so far.
+        """
+        state_types = np.asarray(state_types, dtype=np.int64)
+        if len(state_types) == 0:
+            return
+        num_states = max(len(self.state_types), int(state_types.max()) + 1)
+        if num_states > len(self.counts):
+            # state types were added to the StateTypesTable
+            counts = np.zeros((num_states, num_states), dtype=np.int64)
+            counts[:len(self.counts), :len(self.counts)] = self.counts
+            self.counts = counts
+        if self.last_state is not None:
+            self.counts[self.last_state, state_types[0]] += 1
+        if len(state_types) > 1:
+            np.add.at(self.counts, (state_types[:-1], state_types[1:]), 1)
+        self.last_state = int(state_types[-1])
+
+    def end_sequence(self):
+        """
+        Do not count the transition from the last state to the next state, e.g., at the end of a trial.
+        """
+        self.last_state = None
+
+    def reset(self):
+        """
+        Set all counts to zero and start a new sequence.
+        """
+        self.counts[:] = 0
+        self.last_state = None
+
+    def get_matrices(self, sparse: bool = False):
+        """
+        Return the counts and probabilities of the transitions the same as compute_state_transition_matrix.
+        """
+        counts = self.counts[:len(self.state_types), :len(self.state_types)].copy()
+        if sparse:
+            from scipy.sparse import csr_matrix
+            counts = csr_matrix(counts)
+        return _transition_matrices(counts, self.state_types['state_name'][:], sparse)
+
+
+LAYOUT_CACHE_SIZE = 32
+_layout_cache = OrderedDict()  # frozenset of the state names -> positions of the nodes, least recently used first
+
+
+def _state_graph_layout(G):
+    """
+    Return the positions of the nodes of the state transition graph.
+    """
+    try:
+        return nx.planar_layout(G)
+    except nx.NetworkXException as e:
+        # This may happen if the network is not planar
+        warnings.warn("Error occurred in planar layout. Using shell_layout instead. " + str(e))
+        return nx.shell_layout(G)
+
+
+def _cached_state_graph_layout(G, states):
+    """
+    Return the positions of the nodes of the state transition graph. The layout of each set of states is
+    computed once and reused, such that the graphs of sessions of the same task program are drawn the same.
+    """
+    key = frozenset(states)
+    pos = _layout_cache.get(key)
+    if pos is None:
+        pos = _state_graph_layout(G)
+        _layout_cache[key] = pos
+        while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    else:
+        _layout_cache.move_to_end(key)
+    return pos
+
+
+def clear_layout_cache():
+    """
+    Remove all layouts from the cache of plot_state_transition_graph.
+    """
+    _layout_cache.clear()
 
 
 def plot_state_transition_graph(transition_matrix,
@@ -384,7 +783,9 @@ def plot_state_transition_graph(transition_matrix,
                                 edge_color='black',
                                 edge_font_color='black',
                                 node_font_color='red',
-                                fontsize=12):
+                                fontsize=12,
+                                threshold: float = 0,
+                                use_layout_cache: bool = True):
     """
     Given a DataFrame with the state transition matrix (compute e.g., via compute_state_transition_matrix)
     plot the corresponding networkx graph visualizing the state transitions
@@ -395,27 +796,26 @@ def plot_state_transition_graph(transition_matrix,
     :param figsize: Tuple with the size of the figure
     :param node_params: Dict with keyword arguments for rendering nodes via nx.draw_networkx_nodes.
                         E.g., node_params = { 'node_size': 1500, 'node_shape': 's', 'node_color': 'lightgray' }
+    :param threshold: Only draw the transitions with a weight, i.e., a count or probability, greater than
+                      the threshold. (Default=0)
+    :param use_layout_cache: Reuse the layout of a previous graph with the same states, i.e., the rows of
+                      the transition_matrix, instead of computing it again. (Default=True)
 
     :return: The matplotlib figure generated by the function
     """
     states = transition_matrix.index.tolist()
+    weights = transition_matrix.to_numpy()
+    origins, destinations = np.nonzero(weights > threshold)
+    labels = ["{:.02f}".format(rate) for rate in weights[origins, destinations]]
+    edges = [(states[i], states[j], {'weight': weights[i, j], 'label': label})
+             for i, j, label in zip(origins.tolist(), destinations.tolist(), labels)]
     G = nx.MultiDiGraph()
-    edge_labels = {}
-
-    for i, origin_state in enumerate(states):
-        for j, destination_state in enumerate(states):
-            rate = transition_matrix.loc[origin_state, destination_state]
-            if rate > 0:
-                G.add_edge(origin_state, destination_state, weight=rate, label="{:.02f}".format(rate))
-                edge_labels[(origin_state, destination_state)] = "{:.02f}".format(rate)
+    G.add_nodes_from(states)
+    G.add_edges_from(edges)
+    edge_labels = {(origin, destination): attributes['label'] for origin, destination, attributes in edges}
 
     fig =  plt.figure(figsize=(10, 10) if figsize is None else figsize)
-    try:
-        pos = nx.planar_layout(G)
-    except nx.NetworkXException as e:
-        # This may happen if the network is not planar
-        warnings.warn("Error occurred in planar layout. Using shell_layout instead. " + str(e))
-        pos = nx.shell_layout(G)
+    pos = _cached_state_graph_layout(G, states) if use_layout_cache else _state_graph_layout(G)
 
     nx.draw_networkx_edges(G, pos, width=1.0, alpha=0.5, edge_color=edge_color)
     nx.draw_networkx_labels(G, pos, font_weight=2, font_color=node_font_color, font_size=fontsize)
@@ -0,0 +1,179 @@
+"""
+Module for writing the trials of a live session to an NWB file while the session is running
+
+Workflow:
+with StreamingWriter(path='session.nwb', nwbfile=nwbfile, task=task) as writer:
+    for trial in source:
+        writer.add_trial(trial)
+"""
+import queue
+import time
+from collections import namedtuple
+
+import numpy as np
+from pynwb import NWBHDF5IO
+from ndx_structured_behavior import EventsTable, ActionsTable, StatesTable, TrialsTable, TaskRecording
+
+# The rows of a trial. states, events and actions map the columns of the add_rows method of the StatesTable,
+# EventsTable and ActionsTable to the values of the rows of the trial, e.g.,
+# events=dict(event_type=['Port1In'], timestamp=[0.5], value=['in']). The types are either the index or the
+# name of the type in the types table. All times are relative to the session start.
+StreamedTrial = namedtuple('StreamedTrial', ['start_time', 'stop_time', 'states', 'events', 'actions'])
+
+# The number of rows of each chunk of the datasets written by the StreamingWriter
+DEFAULT_STREAM_CHUNK_ROWS = 1024
+
+
+def queue_source(trial_queue, sentinel=None, timeout=None):
+    """
+    Yield the StreamedTrial put into a queue.Queue, e.g., by the thread that reads the socket of the rig,
+    until the sentinel is put into the queue.
+
+    timeout: The number of seconds to wait for the next trial. Stop if no trial arrives in time.
+             (Default=None, i.e., wait until the sentinel arrives)
+    """
+    while True:
+        try:
+            trial = trial_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        if trial is sentinel:
+            return
+        yield trial
+
+
+class StreamingWriter():
+    """
+    Append the trials of a live session to an NWB file as they arrive.
+
+    The trials are buffered in memory and written every flush_trials trials or flush_interval seconds. The first
+    flush writes the NWBFile with the Task, the TaskRecording and the TrialsTable, with every dataset of the
+    tables chunked and resizable (see DataIOMixin.configure_dataio). Each later flush opens the file in append
+    mode, appends the buffered trials with TrialsTable.append_trials and closes the file, such that the file
+    is complete after each flush and a crash loses at most the trials since the last flush.
+    """
+
+    def __init__(self, path, nwbfile, task, flush_trials=1, flush_interval=None,
+                 chunk_rows=DEFAULT_STREAM_CHUNK_ROWS, compression='gzip', encode_values=False):
+        """
+        path: The path of the NWB file to write
+        nwbfile: The NWBFile with the session metadata. Its TaskRecording and trials are added by the writer.
+        task: The Task with the types tables of the task program
+        flush_trials: Flush after this number of trials
+        flush_interval: Also flush when this number of seconds has passed since the last flush
+        chunk_rows: The number of rows of each chunk of the datasets
+        compression: The compression filter of the datasets, or False for no compression
+        encode_values: Store the values of the events and actions as integer codes, see EventsTable
+        """
+        self.path = path
+        self.nwbfile = nwbfile
+        self.task = task
+        self.flush_trials = flush_trials
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.encode_values = encode_values
+        self.num_trials = 0  # the number of trials written to the file
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def add_trial(self, trial):
+        """
+        Buffer a StreamedTrial and flush if flush_trials trials are buffered or flush_interval has passed.
+        """
+        self._buffer.append(trial)
+        if (len(self._buffer) >= self.flush_trials or
+                self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def write_stream(self, source):
+        """
+        Add each StreamedTrial of an iterable, e.g., queue_source, and flush at the end.
+        """
+        for trial in source:
+            self.add_trial(trial)
+        self.flush()
+
+    def flush(self):
+        """
+        Write the buffered trials to the file.
+        """
+        if len(self._buffer) == 0:
+            return
+        if self.num_trials == 0:
+            self._write_file()
+        else:
+            with NWBHDF5IO(self.path, mode='a') as io:
+                nwbfile = io.read()
+                recording = nwbfile.get_acquisition('task_recording')
+                self._add_trials(nwbfile.trials, recording.states, recording.events, recording.actions)
+        self.num_trials += len(self._buffer)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Write the remaining buffered trials.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_file(self):
+        """
+        Write the NWBFile with the buffered trials and resizable datasets.
+        """
+        events = EventsTable(description='Event data', event_types_table=self.task.event_types,
+                             encode_values=self.encode_values)
+        actions = ActionsTable(description='OutputAction data', action_types_table=self.task.action_types,
+                               encode_values=self.encode_values)
+        states = StatesTable(description='State data', state_types_table=self.task.state_types)
+        trials = TrialsTable(description='Trial data', states_table=states, events_table=events,
+                             actions_table=actions)
+        self._add_trials(trials, states, events, actions)
+        for table in (events, actions, states, trials):
+            table.configure_dataio(chunk_rows=self.chunk_rows, compression=self.compression, appendable=True)
+
+        if self.task.name not in self.nwbfile.lab_meta_data:
+            self.nwbfile.add_lab_meta_data(self.task)
+        self.nwbfile.add_acquisition(TaskRecording(events=events, states=states, actions=actions))
+        self.nwbfile.trials = trials
+        with NWBHDF5IO(self.path, mode='w') as io:
+            io.write(self.nwbfile)
+
+    def _add_trials(self, trials, states, events, actions):
+        """
+        Append the buffered trials and their rows with TrialsTable.append_trials.
+        """
+        sections = dict()
+        for table, type_column in ((states, 'state_type'), (events, 'event_type'), (actions, 'action_type')):
+            name = table.name
+            rows = [getattr(trial, name) for trial in self._buffer]
+            columns = dict()
+            for column in rows[0]:
+                # the rows of trials without rows, e.g., action_type=[], are skipped because an empty array is
+                # float64 and would change the dtype of the types and values of the other trials
+                values = [np.asarray(trial_rows[column]) for trial_rows in rows if len(trial_rows[column]) > 0]
+                if column == type_column:
+                    values = [self._encode_types(table, type_column, types) for types in values]
+                    columns[column] = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+                else:
+                    columns[column] = np.concatenate(values) if values else np.asarray([])
+            sections[name] = columns
+            sections['num_' + name] = [len(trial_rows[type_column]) for trial_rows in rows]
+        trials.append_trials(start_time=np.asarray([trial.start_time for trial in self._buffer], dtype=np.float64),
+                             stop_time=np.asarray([trial.stop_time for trial in self._buffer], dtype=np.float64),
+                             **sections)
+
+    @staticmethod
+    def _encode_types(table, type_column, types):
+        """
+        Return the type indices of the rows of a trial, given either as indices or as the names of the types.
+        """
+        if types.dtype.kind not in 'iu':
+            types = table[type_column].table.encode(types)
+        return types.astype(np.int64)
@@ -3,7 +3,7 @@ from pynwb.core import DynamicTable
 from hdmf.utils import docval, get_docval, getargs, popargs, AllowPositional
 from hdmf.container import Row
 from ndx_structured_behavior import BEADLTaskProgram
-from .beadl_xml_parser import BeadlXMLParser
+from .beadl_xml_parser import parse_beadl_program
 
 @register_class('TaskArgumentsTable', 'ndx-structured-behavior')
 class TaskArgumentsTable(DynamicTable):
@@ -72,10 +72,7 @@ class TaskArgumentsTable(DynamicTable):
             self._populate_from_program()
 
     def _populate_from_program(self):
-        parsed_xml_object = BeadlXMLParser(string=self.beadl_task_program.data)
-        element = parsed_xml_object.element(element_name='BeadlArguments')
-        parsed_arg_element = parsed_xml_object._parse_protocal_children(element=element)
-        beadl_args = parsed_arg_element['BeadlArgument']
+        beadl_args = parse_beadl_program(self.beadl_task_program.data).arguments
 
         for arg in beadl_args:
             super().add_row(argument_name=arg['name'],argument_description=arg['comment'], expression=arg['expression'],
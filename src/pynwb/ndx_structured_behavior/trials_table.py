@@ -3,10 +3,257 @@ from pynwb.file import LabMetaData
 from pynwb.core import DynamicTable
 from pynwb.epoch import TimeIntervals
 from hdmf.utils import docval, get_docval, popargs, AllowPositional
+from hdmf.container import Data
+from hdmf.common.table import VectorData, VectorIndex, DynamicTableRegion, EnumData
+from hdmf.data_utils import DataIO
+from hdmf.backends.hdf5 import H5DataIO
 from ndx_structured_behavior import BEADLTaskProgram
-from .beadl_xml_parser import BeadlXMLParser
-from .utils import loadmat
-import itertools
+from .beadl_xml_parser import parse_beadl_program
+from .beadl_session import BeadlSession
+from collections import namedtuple
+from functools import partial
+import h5py
+import numpy as np
+import pandas as pd
+
+
+# The default chunking and compression of the columns of the StatesTable, EventsTable and ActionsTable, applied
+# when configure_dataio is called before the table is written.
+# Chunks of DEFAULT_CHUNK_ROWS rows keep reads of a time range to a few chunks and the unlimited maxshape
+# allows rows to be appended to the written datasets.
+DEFAULT_CHUNK_ROWS = 16384
+DEFAULT_COMPRESSION = 'gzip'
+DEFAULT_COMPRESSION_OPTS = 4
+
+# The dtype of the *_index offsets written with configure_dataio(appendable=True). The offsets of a dataset read
+# from a file cannot be cast to a larger dtype, so they are written wide enough for the rows appended later.
+APPENDABLE_INDEX_DTYPE = np.uint32
+
+# The times the timestamps of an EventsTable or ActionsTable are relative to
+TIMESTAMP_REFERENCES = ('session_start_time', 'trial_start_time')
+
+populate_from_matlab_docval = (
+    {
+        'name': 'data_path',
+        'type': str,
+        'doc': 'The path to the matlab data file.',
+        'default': None
+    },
+    {
+        'name': 'session',
+        'type': BeadlSession,
+        'doc': 'The BeadlSession loaded from the matlab data file. Use this to parse the file only once.',
+        'default': None
+    },
+)
+
+
+def _get_session(**kwargs):
+    """
+    Return the BeadlSession passed to populate_from_matlab or load it from the data_path.
+    """
+    session = kwargs['session']
+    if session is None:
+        if kwargs['data_path'] is None:
+            msg = 'Either data_path or session must be provided.'
+            raise ValueError(msg)
+        session = BeadlSession.from_matlab(kwargs['data_path'])
+    return session
+
+
+def _uint_dtype(column, max_value):
+    """
+    Return the unsigned int dtype to store the values of a VectorIndex or the codes of an EnumData up to max_value.
+
+    The dtype of a dataset read from a file is fixed, so a ValueError is raised if max_value does not fit.
+    In memory, the smallest unsigned int that fits is used, the same as VectorIndex.add_vector.
+    """
+    data = column.data
+    if isinstance(data, h5py.Dataset):
+        if max_value > np.iinfo(data.dtype).max:
+            msg = ("Cannot append rows to '%s' because the value %i does not fit its %s dataset. Write the table "
+                   "with configure_dataio(appendable=True) to store the offsets and codes as %s."
+                   % (column.name, max_value, data.dtype, np.dtype(APPENDABLE_INDEX_DTYPE)))
+            raise ValueError(msg)
+        return data.dtype
+    for uint in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if max_value <= np.iinfo(uint).max:
+            break
+    if len(data) > 0:
+        return np.promote_types(np.asarray(data[:]).dtype, uint)
+    return np.dtype(uint)
+
+
+def _extend_column(column, values):
+    """
+    Append all values to the data of a column, a VectorIndex or the id of a table in a single call.
+    """
+    if len(values) == 0:
+        return  # an empty h5py.Dataset selection, e.g., data[-0:], would select the whole dataset
+    if isinstance(column, (VectorIndex, EnumData)):
+        # store the values as unsigned ints, the same as VectorIndex.add_vector, and cast the existing
+        # offsets or codes in memory if a larger dtype is needed
+        uint = _uint_dtype(column, int(np.max(values)))
+        if isinstance(column.data, list) and len(column.data) > 0 and np.asarray(column.data).dtype != uint:
+            column.transform(lambda data: list(np.asarray(data, dtype=uint)))
+        elif isinstance(column.data, np.ndarray) and column.data.dtype != uint:
+            column.transform(lambda data: data.astype(uint))
+        values = np.asarray(values, dtype=uint)
+        new_data = list(values)
+    elif isinstance(values, np.ndarray) and values.dtype == np.float32:
+        # keep the precision of compact float32 values, e.g., timestamps relative to the trial start
+        new_data = list(values)
+    else:
+        # store Python scalars in list data, the same as add_row
+        new_data = np.asarray(values).tolist()
+
+    if isinstance(column.data, np.ndarray):
+        column.transform(lambda data: np.concatenate((data, np.asarray(values, dtype=data.dtype))))
+    else:
+        # VectorData.extend falls back to add_row for each value in subclasses, e.g., DynamicTableRegion
+        Data.extend(column, new_data)
+
+
+def _extend_enum_column(column, values):
+    """
+    Append values to an EnumData column. New values are added to the elements of the column once and
+    the values are stored as the integer codes of their elements.
+
+    The codes are looked up from the elements here instead of with EnumData.add_row, one value at a time, so
+    the encoded tables also add single rows with this function (see _add_encoded_row).
+    """
+    if len(values) == 0:
+        return
+    codes, unique_values = pd.factorize(np.asarray(values, dtype=object))
+    elements = column.elements
+    element_codes = {value: code for code, value in enumerate(elements.data[:])}
+    new_elements = [value for value in unique_values if value not in element_codes]
+    element_codes.update((value, len(elements.data) + i) for i, value in enumerate(new_elements))
+    new_codes = np.asarray([element_codes[value] for value in unique_values], dtype=np.int64)[codes]
+    _uint_dtype(column, int(new_codes.max()))  # check that the codes fit before the elements are extended
+    _extend_column(elements, new_elements)
+    _extend_column(column, new_codes)
+
+
+def _add_encoded_row(table, type_column, **kwargs):
+    """
+    Add a row to an EventsTable or ActionsTable with encoded values with add_rows, such that the codes of the
+    values are looked up in the same way as for multiple rows.
+    """
+    extra = set(kwargs) - {type_column, 'timestamp', 'value', 'duration'}
+    if len(extra) > 0:
+        msg = 'Cannot add the arguments %s to a table with encoded values.' % sorted(extra)
+        raise ValueError(msg)
+    duration = kwargs.pop('duration')
+    table.add_rows(duration=None if duration is None else [duration],
+                   **{name: [value] for name, value in kwargs.items()})
+
+
+def _encoded_value_columns(columns_spec):
+    """
+    Create the required columns of an EventsTable or ActionsTable in order with the 'value' column as an
+    EnumData, i.e., with the values stored as integer codes into the 'value_elements' column.
+    """
+    columns = []
+    for col in columns_spec:
+        if not col.get('required', False):
+            continue
+        if col['name'] == 'value':
+            value = EnumData(name='value', description=col['description'], data=[])
+            columns.extend([value, value.elements])
+        elif col.get('table', False):
+            columns.append(DynamicTableRegion(name=col['name'], description=col['description'], data=[], table=None))
+        else:
+            columns.append(VectorData(name=col['name'], description=col['description'], data=[]))
+    return columns
+
+
+def _check_appendable(table):
+    """
+    Raise a ValueError if the table was read from a file and its datasets cannot be extended in place, i.e., if
+    the file is not open for writing or a dataset is not resizable. This is checked before any rows are added
+    such that a failed append does not leave the columns of the table with different lengths.
+    """
+    datasets = [table.id]
+    for column in table.columns:
+        datasets.append(column)
+        if isinstance(column, EnumData):
+            datasets.append(column.elements)
+    for column in datasets:
+        data = column.data
+        if not isinstance(data, h5py.Dataset):
+            continue
+        if data.file.mode != 'r+':
+            msg = ("Cannot append rows to %s because its file is not open for writing. Open the file with "
+                   "NWBHDF5IO(path, mode='a')." % table.name)
+            raise ValueError(msg)
+        if data.maxshape[0] is not None:
+            msg = ("Cannot append rows to %s because the dataset '%s' is not resizable. Write the table with "
+                   "configure_dataio(appendable=True) to append rows to the file." % (table.name, data.name))
+            raise ValueError(msg)
+
+
+def _add_recorded_rows(table, type_column, **columns):
+    """
+    Add multiple rows to an EventsTable, ActionsTable or StatesTable.
+
+    The type indices are checked against the size of the types table with a single vectorized test
+    and each column is extended once.
+    """
+    type_idx = np.asarray(columns[type_column])
+    num_rows = len(type_idx)
+    for name, values in columns.items():
+        if values is not None and len(values) != num_rows:
+            msg = "column '%s' has %i rows but '%s' has %i rows" % (name, len(values), type_column, num_rows)
+            raise ValueError(msg)
+    if num_rows > 0 and (type_idx.min() < 0 or type_idx.max() >= len(table[type_column].table)):
+        msg = 'Type index is out of bounds'
+        raise ValueError(msg)
+    _check_appendable(table)
+
+    # the optional duration column is created with the first rows that have a duration, the same as in add_row
+    if 'duration' not in columns:
+        pass
+    elif columns['duration'] is None:
+        columns.pop('duration')
+        if 'duration' in table.colnames:
+            raise ValueError("column 'duration' missing")
+    elif 'duration' not in table.colnames:
+        if len(table) > 0:
+            msg = "Cannot add column 'duration' to a table that already has rows without a duration."
+            raise ValueError(msg)
+        description = [col['description'] for col in table.__columns__ if col['name'] == 'duration'][0]
+        table.add_column(name='duration', description=description)
+
+    # the codes of an EnumData are extended first because they can fail if a code does not fit its dataset
+    for name, values in columns.items():
+        if isinstance(table[name], EnumData):
+            _extend_enum_column(table[name], values)
+    first_id = len(table)
+    _extend_column(table.id, np.arange(first_id, first_id + num_rows))
+    for name, values in columns.items():
+        if not isinstance(table[name], EnumData):
+            _extend_column(table[name], values)
+
+
+class DataProgramValidation(namedtuple('DataProgramValidation', ['valid', 'missing', 'counts'])):
+    """
+    The result of data_program_validator. It evaluates to True if all types from the data are in the program.
+
+    valid: True if all types from the data are in the program
+    missing: Sorted array of the types from the data that are not in the program
+    counts: The number of times each of the missing types occurs in the data
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.valid)
+
+    def summary(self):
+        """
+        Return a string that lists the missing types with the number of times they occur in the data.
+        """
+        return ', '.join('%s (%i)' % (name, count) for name, count in zip(self.missing, self.counts))
 
 
 def data_program_validator(
@@ -16,22 +263,309 @@ def data_program_validator(
     """
     This method checks that each event/state/action type from the data is in the program.
 
-    data: A list of all unique types from the data
-    program: A list of all unique types from the program
+    data: An array with the types from the data, e.g., all recorded event names or type indices
+    program: An array or VectorData with all unique types from the program
+
+    Returns a DataProgramValidation with the types that are missing from the program and the number
+    of times they occur in the data.
     """
-    valid = True
-    for _type in data:
-        if _type in program:
-            continue
+    if isinstance(data, pd.Series):
+        data = data.array
+    if isinstance(data, pd.Categorical):
+        codes, unique_data = data.codes, np.asarray(data.categories)
+    else:
+        codes, unique_data = pd.factorize(np.asarray(data).ravel())
+    # only the unique types are looked up in the program, the counts come from the codes
+    counts = np.bincount(codes[codes >= 0], minlength=len(unique_data))
+    unique_data, counts = unique_data[counts > 0], counts[counts > 0]
+    missing = ~np.isin(unique_data, np.asarray(program[:]))
+    order = np.argsort(unique_data[missing], kind='stable')
+    return DataProgramValidation(valid=not np.any(missing),
+                                 missing=unique_data[missing][order],
+                                 counts=counts[missing][order])
+
+
+class TimeQueryMixin():
+    """
+    Find the rows of an EventsTable or ActionsTable within a time window.
+
+    The timestamps are read once, e.g., from a table read from a file, and are kept sorted for binary search.
+    The index is rebuilt when the number of rows changes.
+
+    If the timestamps are relative to the start of their trial (timestamp_reference='trial_start_time'), the
+    absolute times are reconstructed from the start_time of the trials in the TrialsTable.
+    """
+
+    _trials_column = None  # the name of the ragged column of the TrialsTable that references the rows
+
+    def _session_timestamps(self, session, section):
+        """
+        Return the timestamps of the section of the BeadlSession to store in this table, i.e., as float32 offsets
+        from the start of their trial or as times relative to the session start.
+        """
+        timestamps = getattr(session, section)['timestamp']
+        if self.timestamp_reference == 'trial_start_time':
+            return np.asarray(timestamps, dtype=np.float32)
+        return timestamps + session.row_offsets(section)
+
+    @docval(
+        {
+            'name': 'trials',
+            'type': 'TrialsTable',
+            'doc': "The TrialsTable with the rows of each trial. Required if timestamp_reference='trial_start_time'.",
+            'default': None,
+        },
+    )
+    def get_absolute_timestamps(self, **kwargs):
+        """
+        Return the timestamps of all rows relative to the session start as float64.
+        """
+        trials = popargs('trials', kwargs)
+        timestamps = np.asarray(self['timestamp'].data[:], dtype=np.float64)
+        if self.timestamp_reference == 'session_start_time':
+            return timestamps
+        if trials is None:
+            msg = ("The timestamps of '%s' are relative to the start of their trial. "
+                   "Pass the TrialsTable to reconstruct the absolute times." % self.name)
+            raise ValueError(msg)
+        index = getattr(trials, self._trials_column + '_index')
+        rows = np.asarray(getattr(trials, self._trials_column).data[:], dtype=np.int64)
+        counts = np.diff(np.asarray(index.data[:], dtype=np.int64), prepend=0)
+        offsets = np.full(len(timestamps), np.nan)
+        offsets[rows] = np.repeat(np.asarray(trials['start_time'].data[:], dtype=np.float64), counts)
+        return timestamps + offsets
+
+    def _get_time_index(self, trials=None):
+        """
+        Return the sorted timestamps and the rows in that order, or None if the rows are already sorted.
+        """
+        time_index = getattr(self, '_time_index', None)
+        if time_index is None or time_index[0] != len(self):
+            timestamps = self.get_absolute_timestamps(trials=trials)
+            if np.all(timestamps[1:] >= timestamps[:-1]):
+                order = None
+            else:
+                order = np.argsort(timestamps, kind='stable')
+                timestamps = timestamps[order]
+            time_index = (len(self), timestamps, order)
+            self._time_index = time_index
+        return time_index[1], time_index[2]
+
+    @docval(
+        {
+            'name': 'start',
+            'type': (int, float),
+            'doc': 'The start of the time window (inclusive).',
+        },
+        {
+            'name': 'stop',
+            'type': (int, float),
+            'doc': 'The stop of the time window (exclusive).',
+        },
+        {
+            'name': 'df',
+            'type': bool,
+            'doc': 'Return a DataFrame with the rows. Otherwise, return the row indices.',
+            'default': True,
+        },
+        {
+            'name': 'trials',
+            'type': 'TrialsTable',
+            'doc': "The TrialsTable with the rows of each trial. Required if timestamp_reference='trial_start_time'.",
+            'default': None,
+        },
+    )
+    def query_time(self, **kwargs):
+        """
+        Return the rows with a timestamp in [start, stop).
+
+        If the rows are sorted by time, the row indices are returned as a slice and only those rows are read.
+        Otherwise, they are returned as a sorted array of row indices.
+        """
+        start, stop, df, trials = popargs('start', 'stop', 'df', 'trials', kwargs)
+        timestamps, order = self._get_time_index(trials)
+        first, last = np.searchsorted(timestamps, [start, max(start, stop)], side='left')
+        if order is None:
+            rows = slice(int(first), int(last))
         else:
-            valid = False
-            break
+            rows = np.sort(order[first:last])
+        if df:
+            return self[rows]
+        return rows
 
-    return valid
+
+class DataIOMixin():
+    """
+    Configure the chunking and compression of the columns of a StatesTable, EventsTable, ActionsTable or
+    TrialsTable on write. The defaults are applied only by configure_dataio, so a table written without calling it
+    has contiguous, uncompressed columns.
+    """
+
+    @docval(
+        {
+            'name': 'columns',
+            'type': ('array_data', dict),
+            'doc': ('The names of the columns to configure or a dict mapping the names to H5DataIO arguments that '
+                    'override the other arguments for that column. By default, all columns that are not ragged.'),
+            'default': None,
+        },
+        {
+            'name': 'chunk_rows',
+            'type': int,
+            'doc': ('The number of rows of each chunk. By default, DEFAULT_CHUNK_ROWS or the number of rows if '
+                    'the table is smaller.'),
+            'default': None,
+        },
+        {
+            'name': 'compression',
+            'type': (str, bool),
+            'doc': "The compression filter, e.g., 'gzip' or 'lzf', or False for no compression.",
+            'default': DEFAULT_COMPRESSION,
+        },
+        {
+            'name': 'compression_opts',
+            'type': int,
+            'doc': 'The compression level of gzip. (Default=DEFAULT_COMPRESSION_OPTS)',
+            'default': None,
+        },
+        {
+            'name': 'shuffle',
+            'type': bool,
+            'doc': 'Use the shuffle filter to improve the compression.',
+            'default': True,
+        },
+        {
+            'name': 'appendable',
+            'type': bool,
+            'doc': ('Also configure the id and the index and data of the ragged columns, such that rows can be '
+                    'appended to every dataset of the table after it is written, e.g., by the StreamingWriter.'),
+            'default': False,
+        },
+    )
+    def configure_dataio(self, **kwargs):
+        """
+        Wrap the data of the columns in H5DataIO with the given chunking and compression. Call this after the
+        rows have been added and before the table is written. NWBHDF5IO.write does not call it.
+        """
+        columns, chunk_rows, compression, compression_opts, shuffle, appendable = popargs(
+            'columns', 'chunk_rows', 'compression', 'compression_opts', 'shuffle', 'appendable', kwargs)
+        if columns is None and appendable:
+            columns = ['id'] + [column.name for column in self.columns]
+        elif columns is None:
+            columns = [name for name in self.colnames if not isinstance(self[name], VectorIndex)]
+        if not isinstance(columns, dict):
+            columns = {name: dict() for name in columns}
+        if chunk_rows is None:
+            chunk_rows = min(DEFAULT_CHUNK_ROWS, max(len(self), 1))
+        if compression is False:
+            compression = None
+        elif compression == 'gzip' and compression_opts is None:
+            compression_opts = DEFAULT_COMPRESSION_OPTS
+
+        if appendable:
+            # the datasets by name, e.g., 'events' and 'events_index' for the ragged column 'events'
+            datasets = {column.name: column for column in self.columns}
+            datasets['id'] = self.id
+        else:
+            datasets = {name: self[name] for name in self.colnames}
+        for name, column_options in columns.items():
+            if name not in datasets:
+                msg = "'%s' is not a column of %s." % (name, self.name)
+                raise ValueError(msg)
+            column = datasets[name]
+            if isinstance(column, VectorIndex) and not appendable:
+                msg = "Cannot configure the ragged column '%s'." % name
+                raise ValueError(msg)
+            if isinstance(column.data, DataIO):
+                msg = "The data of column '%s' is already wrapped in a DataIO." % name
+                raise ValueError(msg)
+            if isinstance(column, (VectorIndex, EnumData)):
+                # the offsets and codes of the rows appended later must fit the dtype of the written dataset
+                uint = np.promote_types(_uint_dtype(column, 0), APPENDABLE_INDEX_DTYPE)
+                column.transform(lambda data, uint=uint: np.asarray(data, dtype=uint))
+            options = dict(chunks=(chunk_rows,), maxshape=(None,), compression=compression, shuffle=shuffle)
+            if compression_opts is not None:
+                options['compression_opts'] = compression_opts
+            options.update(column_options)
+            if options['compression'] != 'gzip' and 'compression_opts' not in column_options:
+                options.pop('compression_opts', None)  # e.g., lzf has no compression level
+            column.transform(lambda data, options=options: H5DataIO(data=data, **options))
+
+
+class CategoricalTypeMixin():
+    """
+    Export an EventsTable, ActionsTable or StatesTable to a DataFrame with the types as a pandas Categorical.
+    """
+
+    _type_column = None  # the DynamicTableRegion column with the types, e.g., 'event_type'
+
+    def to_categorical_dataframe(self):
+        """
+        Return a DataFrame built directly from the data of the columns. The type column is a pandas Categorical
+        with the type indices as codes and the names from the types table as categories.
+        """
+        columns = dict()
+        for name in self.colnames:
+            column = self[name]
+            if name == self._type_column:
+                types_table = column.table
+                if types_table is None:
+                    msg = "The '%s' column has no types table." % name
+                    raise ValueError(msg)
+                codes = np.asarray(column.data[:], dtype=np.int64)
+                categories = pd.Index(types_table[types_table._name_column].data[:])
+                if categories.is_unique:
+                    columns[name] = pd.Categorical.from_codes(codes, categories=categories)
+                else:
+                    # the categories must be unique, so map the codes to the names of the rows
+                    columns[name] = pd.Categorical(np.asarray(categories, dtype=object)[codes])
+            elif isinstance(column, VectorIndex):
+                columns[name] = column[:]
+            elif isinstance(column, EnumData):
+                # the values are decoded by pandas only when they are accessed
+                columns[name] = pd.Categorical.from_codes(np.asarray(column.data[:], dtype=np.int64),
+                                                          categories=pd.Index(column.elements.data[:]))
+            else:
+                columns[name] = column.data[:]
+        return pd.DataFrame(columns, index=pd.Index(self.id.data[:], name='id'))
+
+
+class EncodedValueMixin():
+    """
+    Decode the 'value' column of an EventsTable or ActionsTable stored as an EnumData when selecting rows.
+
+    EnumData decodes with fancy indexing into its elements, which fails on a file when the codes are not
+    increasing, so the codes are decoded here through the elements read into memory instead.
+    """
+
+    def _select_with_values(self, select, rows, kwargs):
+        """Call select(**kwargs) without the 'value' column and insert the decoded values of the rows."""
+        column = DynamicTable.get(self, 'value')
+        exclude = kwargs.get('exclude') or set()
+        if not isinstance(column, EnumData) or 'value' in exclude or kwargs.get('index', False):
+            return select(**kwargs)
+        kwargs['exclude'] = exclude | {'value'}
+        ret = select(**kwargs)
+        codes = np.asarray(column.data[rows], dtype=np.int64)
+        values = np.asarray(column.elements.data[:], dtype=object)[codes]
+        position = [name for name in self.colnames if name not in exclude].index('value')
+        ret.insert(position, 'value', values)
+        return ret
+
+    def get(self, key, default=None, df=True, index=True, **kwargs):
+        """Select a subset from the table. See DynamicTable.get."""
+        if isinstance(key, (str, tuple)) or not df:
+            return super().get(key, default=default, df=df, index=index, **kwargs)
+        kwargs.update(default=default, df=df, index=index)
+        return self._select_with_values(partial(super().get, key), key, kwargs)
+
+    def to_dataframe(self, **kwargs):
+        """Produce a pandas DataFrame containing this table's data. See DynamicTable.to_dataframe."""
+        return self._select_with_values(super().to_dataframe, slice(None), kwargs)
 
 
 @register_class('TrialsTable', 'ndx-structured-behavior')
-class TrialsTable(TimeIntervals):
+class TrialsTable(DataIOMixin, TimeIntervals):
     """A table to hold trials data."""
 
     __columns__ = (
@@ -115,11 +649,207 @@ class TrialsTable(TimeIntervals):
     )
     def add_row(self, **kwargs):
         """Add a trial to this table."""
+        _check_appendable(self)
         super().add_row(**kwargs)
         self._set_dtr_ref()
 
     add_trial = add_row  # alias for add_row
 
+    @docval(
+        {
+            'name': 'start_time',
+            'type': 'array_data',
+            'doc': ('The start time of each trial.'),
+        },
+        {
+            'name': 'stop_time',
+            'type': 'array_data',
+            'doc': ('The stop time of each trial.'),
+        },
+        {
+            'name': 'num_states',
+            'type': 'array_data',
+            'doc': ('The number of states of each trial.'),
+            'default': None,
+        },
+        {
+            'name': 'num_events',
+            'type': 'array_data',
+            'doc': ('The number of events of each trial.'),
+            'default': None,
+        },
+        {
+            'name': 'num_actions',
+            'type': 'array_data',
+            'doc': ('The number of actions of each trial.'),
+            'default': None,
+        },
+        allow_extra=True,
+        allow_positional=AllowPositional.ERROR,
+    )
+    def add_trials(self, **kwargs):
+        """
+        Add multiple trials to this table at once.
+
+        The states, events and actions of the trials must be consecutive rows of the StatesTable, EventsTable
+        and ActionsTable, starting after the rows referenced by the trials that are already in this table. The
+        *_index offsets are computed from the number of rows of each trial with a single cumsum.
+
+        The values of the other columns of the table, e.g., the BeadlArguments added by populate_from_matlab,
+        are passed as extra keyword arguments with one value per trial.
+        """
+        start_time, stop_time = popargs('start_time', 'stop_time', kwargs)
+        ragged_counts, columns = self._check_trials(start_time, stop_time, **kwargs)
+        num_trials = len(start_time)
+        if num_trials == 0:
+            return
+
+        for name in ragged_counts:
+            # the optional columns are added to an empty table, the same as in add_row
+            if getattr(self, name) is None:
+                description = [col['description'] for col in self.__columns__ if col['name'] == name][0]
+                self.add_column(name=name, description=description, index=True, table=True)
+        self._set_dtr_ref()
+
+        first_id = len(self)
+        _extend_column(self.id, np.arange(first_id, first_id + num_trials))
+        _extend_column(self['start_time'], start_time)
+        _extend_column(self['stop_time'], stop_time)
+        for name, values in columns.items():
+            _extend_column(self[name], values)
+        for name, counts in ragged_counts.items():
+            region, index = getattr(self, name), getattr(self, name + '_index')
+            first_row = len(region.data)
+            ends = np.cumsum(counts) + first_row
+            _extend_column(index, ends)
+            _extend_column(region, np.arange(first_row, ends[-1]))
+
+    def _check_trials(self, start_time, stop_time, **kwargs):
+        """
+        Check the arguments of add_trials before any column is extended and return the number of rows of each
+        trial by ragged column and the values of the other columns by name.
+        """
+        num_trials = len(start_time)
+        if len(stop_time) != num_trials:
+            msg = "'stop_time' has %i rows but 'start_time' has %i rows" % (len(stop_time), num_trials)
+            raise ValueError(msg)
+
+        ragged_counts = dict()
+        for name in ('states', 'events', 'actions'):
+            counts = kwargs['num_' + name]
+            if counts is None:
+                continue
+            if len(counts) != num_trials:
+                msg = "'num_%s' has %i rows but 'start_time' has %i rows" % (name, len(counts), num_trials)
+                raise ValueError(msg)
+            ragged_counts[name] = np.asarray(counts, dtype=np.int64)
+
+        columns = {name: values for name, values in kwargs.items()
+                   if name not in ('num_states', 'num_events', 'num_actions')}
+        for name, values in columns.items():
+            if name not in self.colnames or name in ('start_time', 'stop_time') or name in ragged_counts:
+                msg = "'%s' is not a column of %s." % (name, self.name)
+                raise ValueError(msg)
+            if isinstance(self[name], VectorIndex):
+                msg = "Cannot add trials to the ragged column '%s'." % name
+                raise ValueError(msg)
+            if len(values) != num_trials:
+                msg = "'%s' has %i rows but 'start_time' has %i rows" % (name, len(values), num_trials)
+                raise ValueError(msg)
+
+        indexed_colnames = set(ragged_counts) | set(name + '_index' for name in ragged_counts)
+        missing = set(self.colnames) - {'start_time', 'stop_time'} - indexed_colnames - set(columns)
+        if len(missing) > 0:
+            msg = 'Cannot add trials without the columns %s.' % sorted(missing)
+            raise ValueError(msg)
+        if num_trials == 0:
+            return ragged_counts, columns
+        _check_appendable(self)
+
+        for name, counts in ragged_counts.items():
+            if getattr(self, name) is None:
+                if len(self) > 0:
+                    msg = "Cannot add column '%s' to a table that already has trials without %s." % (name, name)
+                    raise ValueError(msg)
+                continue
+            # the offsets of a dataset read from a file must fit its dtype
+            _uint_dtype(getattr(self, name + '_index'), len(getattr(self, name).data) + int(np.sum(counts)))
+        return ragged_counts, columns
+
+    @docval(
+        *get_docval(add_trials),
+        {
+            'name': 'states',
+            'type': dict,
+            'doc': ('The columns of StatesTable.add_rows with the states of all new trials, e.g., '
+                    'dict(state_type=[...], start_time=[...], stop_time=[...]).'),
+            'default': None,
+        },
+        {
+            'name': 'events',
+            'type': dict,
+            'doc': 'The columns of EventsTable.add_rows with the events of all new trials.',
+            'default': None,
+        },
+        {
+            'name': 'actions',
+            'type': dict,
+            'doc': 'The columns of ActionsTable.add_rows with the actions of all new trials.',
+            'default': None,
+        },
+        allow_extra=True,
+        allow_positional=AllowPositional.ERROR,
+    )
+    def append_trials(self, **kwargs):
+        """
+        Append trials together with their states, events and actions, e.g., a continuation of the session to a
+        file opened with NWBHDF5IO(path, mode='a').
+
+        The rows are added to the StatesTable, EventsTable and ActionsTable with add_rows and the trials with
+        add_trials, such that the *_index offsets of the new trials continue after those of the existing trials.
+        For a table read from a file, the datasets are extended in place and only the new rows are written. All
+        tables are checked before any rows are added. The values of the other columns of this table are passed as
+        extra keyword arguments, the same as in add_trials.
+        """
+        sections = {name: popargs(name, kwargs) for name in ('states', 'events', 'actions')}
+        targets = dict()
+        for name, rows in sections.items():
+            if rows is None:
+                continue
+            counts = kwargs['num_' + name]
+            table = self._get_target_table(name)
+            if counts is None or table is None:
+                msg = "Appending %s requires 'num_%s' and the table of the %s." % (name, name, name)
+                raise ValueError(msg)
+            type_column = table._type_column
+            if int(np.sum(counts)) != len(rows[type_column]):
+                msg = "'%s' has %i rows but 'num_%s' adds up to %i" % (name, len(rows[type_column]), name,
+                                                                       int(np.sum(counts)))
+                raise ValueError(msg)
+            region = getattr(self, name)
+            num_referenced = 0 if region is None else len(region.data)
+            if num_referenced != len(table):
+                msg = ('Cannot append %s because the trials reference %i of the %i rows of %s.'
+                       % (name, num_referenced, len(table), table.name))
+                raise ValueError(msg)
+            targets[name] = (table, rows)
+
+        self._check_trials(**kwargs)
+        for table, _ in targets.values():
+            _check_appendable(table)
+        for table, rows in targets.values():
+            table.add_rows(**rows)
+        self.add_trials(**kwargs)
+
+    def _get_target_table(self, name):
+        """
+        Return the StatesTable, EventsTable or ActionsTable of the ragged column with the given name.
+        """
+        region = getattr(self, name)
+        if region is not None and region.table is not None:
+            return region.table
+        return {'states': self._states_table, 'events': self._events_table, 'actions': self._action_table}[name]
+
     def _set_dtr_ref(self):
         # set the DynamicTableRegion table reference if the table reference has been provided and the
         # column already exists
@@ -132,91 +862,105 @@ class TrialsTable(TimeIntervals):
         if self._action_table is not None and self.actions is not None and self.actions.table is None:
             self.actions.table = self._action_table
 
+    def _trial_rows(self, column_name, trial, stop, df):
+        """
+        Return the rows of the states, events or actions table that belong to the trials in [trial, stop).
+
+        Only the offsets of the trials are read from the VectorIndex and only the region of the trials is read
+        from the DynamicTableRegion. If the rows of the trials are contiguous, which is the case for trials added
+        with add_trials or populate_from_matlab, they are returned as a slice.
+        """
+        region = getattr(self, column_name)
+        if region is None:
+            msg = "TrialsTable has no column '%s'." % column_name
+            raise ValueError(msg)
+        if stop is None:
+            if trial < 0 or trial >= len(self):
+                msg = 'Trial %i is out of bounds for a TrialsTable with %i trials.' % (trial, len(self))
+                raise ValueError(msg)
+            stop = trial + 1
+        elif trial < 0 or stop > len(self) or trial > stop:
+            msg = 'Trials %i to %i are out of bounds for a TrialsTable with %i trials.' % (trial, stop, len(self))
+            raise ValueError(msg)
+        index = getattr(self, column_name + '_index')
+        start = int(index.data[trial - 1]) if trial > 0 else 0
+        end = int(index.data[stop - 1]) if stop > 0 else 0
+        rows = np.asarray(region.data[start:end], dtype=np.int64)
+        if len(rows) == 0 or rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            first = int(rows[0]) if len(rows) > 0 else 0
+            rows = slice(first, first + len(rows))
+        if df:
+            return region.table[rows]
+        return rows
+
     @docval(
         {
-            'name': 'data_path',
-            'type': str,
-            'doc': 'The path to the matlab data file.'
-        }
+            'name': 'trial',
+            'type': int,
+            'doc': 'The index of the trial.',
+        },
+        {
+            'name': 'df',
+            'type': bool,
+            'doc': 'Return a DataFrame with the rows. Otherwise, return the row indices.',
+            'default': True,
+        },
+        {
+            'name': 'stop',
+            'type': int,
+            'doc': 'Return the rows of all trials from trial up to stop (exclusive) instead of a single trial.',
+            'default': None,
+        },
     )
+    def trial_states(self, **kwargs):
+        """
+        Return the states of a trial as a DataFrame, or as a slice of the rows of the StatesTable, or an array of
+        row indices if the rows are not contiguous, which can be used to index the columns without a copy.
+        """
+        trial, df, stop = popargs('trial', 'df', 'stop', kwargs)
+        return self._trial_rows('states', trial, stop, df)
+
+    @docval(*get_docval(trial_states))
+    def trial_events(self, **kwargs):
+        """
+        Return the events of a trial as a DataFrame, or as a slice of the rows of the EventsTable, or an array of
+        row indices if the rows are not contiguous, which can be used to index the columns without a copy.
+        """
+        trial, df, stop = popargs('trial', 'df', 'stop', kwargs)
+        return self._trial_rows('events', trial, stop, df)
+
+    @docval(*get_docval(trial_states))
+    def trial_actions(self, **kwargs):
+        """
+        Return the actions of a trial as a DataFrame, or as a slice of the rows of the ActionsTable, or an array of
+        row indices if the rows are not contiguous, which can be used to index the columns without a copy.
+        """
+        trial, df, stop = popargs('trial', 'df', 'stop', kwargs)
+        return self._trial_rows('actions', trial, stop, df)
+
+    @docval(*populate_from_matlab_docval)
     def populate_from_matlab(self, **kwargs):
         states_table = self._states_table
         events_table = self._events_table
         actions_table = self._action_table
-        file_path = kwargs['data_path']
-
-        matlab_file = loadmat(file_path)
-        states_data = matlab_file['BeadlData']['States']
-        events_data = matlab_file['BeadlData']['Events']
-        args_data = matlab_file['BeadlData']['BeadlArguments']
-
-        trial_paths = [i['TrialPath'] for i in states_data]
-
-        # retrieve start and stop times for trial
-        start_times = matlab_file['BeadlData']['SessionMetaData']['TrialStartOffset']
-        stop_times=[]
-        trial_length=[]
-        for trial in trial_paths:
-            end_time = trial[-1]['stateStartTime']
-            stop_times.append(end_time)
-            trial_length.append(len(trial))
-
-        stop_times = [sum(value) for value in zip(start_times, stop_times)]
-
-        states_index=[]
-        states_index_ranges=[]
-        for i in range(len(trial_length)):
-            if i==0:
-                states_index.append(trial_length[i])
-                states_index_ranges.append(list(range(trial_length[i])))
-            else:
-                end=states_index[i-1]+trial_length[i]
-                states_index.append(end)
-                states_index_ranges.append(list(range(states_index[i-1], end)))
-
-
-        #events vector index data
-        trial_events_length =[]
-        for trial in events_data:
-            trial_events=trial['AllEvents']
-            if type(trial_events)!= list:
-                trial_events=[trial_events]
-            trial_events_length.append(len(trial_events))
-
-        events_index=[]
-        events_index_ranges=[]
-        for i in range(len(trial_events_length)):
-            if i==0:
-                events_index.append(trial_events_length[i])
-                events_index_ranges.append(list(range(trial_events_length[i])))
-            else:
-                end=events_index[i-1]+trial_events_length[i]
-                events_index.append(events_index[i-1]+trial_events_length[i])
-                events_index_ranges.append(list(range(events_index[i-1], end)))
-
-        #retrieve actions
-        trial_actions_length =[]
-        for trial in states_data:
-            trial_actions=trial['StateOutputActions']
-            if type(trial_actions)!= list:
-                trial_actions=[trial_actions]
-            trial_actions_length.append(len(trial_actions))
-
-        action_index=[]
-        action_index_ranges=[]
-        for i in range(len(trial_actions_length)):
-            if i==0:
-                action_index.append(trial_actions_length[i])
-                action_index_ranges.append(list(range(trial_actions_length[i])))
-            else:
-                end=action_index[i-1]+trial_actions_length[i]
-                action_index.append(action_index[i-1]+trial_actions_length[i])
-                action_index_ranges.append(list(range(action_index[i-1], end)))
-
-
-        #populate trials_table
-        for i in range(len(start_times)):
-            self.add_trial(start_time=start_times[i], stop_time=stop_times[i], states=states_index_ranges[i], events=events_index_ranges[i], actions=action_index_ranges[i])
+        session = _get_session(**kwargs)
+        args_data = session.arguments
+
+        # retrieve start and stop times for trial. The trial ends with the start of its last state or, if it has
+        # no states, at its start.
+        start_times = session.trial_start_offset
+        num_states = session.counts('states')
+        last_state_start = np.zeros(len(start_times))
+        has_states = num_states > 0
+        last_state_start[has_states] = session.states['start_time'][session.states['index'][has_states] - 1]
+        stop_times = start_times + last_state_start
+
+        #populate trials_table. The states, events and actions of each trial follow those of the previous trial.
+        self.add_trials(start_time=start_times,
+                        stop_time=stop_times,
+                        num_states=num_states,
+                        num_events=session.counts('events'),
+                        num_actions=session.counts('actions'))
 
         #populate BeadlArguments as columns
         for arg in args_data:
@@ -226,9 +970,11 @@ class TrialsTable(TimeIntervals):
 
 
 @register_class('StatesTable', 'ndx-structured-behavior')
-class StatesTable(TimeIntervals):
+class StatesTable(CategoricalTypeMixin, DataIOMixin, TimeIntervals):
     """A table to hold states data."""
 
+    _type_column = 'state_type'
+
     __columns__ = (
         {
             'name': 'state_type',
@@ -270,6 +1016,24 @@ class StatesTable(TimeIntervals):
         super().__init__(**kwargs)
         if self.state_type is not None and self.state_type.table is None:
             self.state_type.table = state_types_table
+        self._listeners = list()
+
+    def add_listener(self, listener):
+        """
+        Call listener with the array of the state types of the new rows each time rows are added with add_row
+        or add_rows, e.g., StateTransitionAccumulator.update.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Stop calling a listener added with add_listener.
+        """
+        self._listeners.remove(listener)
+
+    def _notify_listeners(self, state_types):
+        for listener in self._listeners:
+            listener(state_types)
 
     @docval(
         {
@@ -288,113 +1052,105 @@ class StatesTable(TimeIntervals):
     )
     def add_row(self, **kwargs):
         """Add a state to this table."""
+        _check_appendable(self)
         super().add_row(**kwargs)
+        self._notify_listeners(np.asarray([kwargs['state_type']]))
 
     add_state = add_row  # alias for add_row
 
-    def _generate_state_end_times(self, **kwargs):
-        trials = kwargs['trials'] # [i['TrialPath'] for i in data['States']] *Note*: matlab_file=loadmat(beadl_path) ---> data=matlab_file['BeadlData']
-        offset_times = kwargs['offset_times']
-        end=[]
-        for entry, time in zip(trials,offset_times):
-            for i in range(len(entry)):
-                if entry[i]['stateName']!= 'End':
-                    end_time= entry[i+1]['stateStartTime']
-                    end.append(float(end_time)+time)
-                else:
-                    end_time= entry[i]['stateStartTime']
-                    end.append(float(end_time)+time)
-        return end
+    @docval(
+        {
+            'name': 'state_type',
+            'type': 'array_data',
+            'doc': ('The state type of each state.'),
+        },
+        {
+            'name': 'start_time',
+            'type': 'array_data',
+            'doc': ('The start time of each state.'),
+        },
+        {
+            'name': 'stop_time',
+            'type': 'array_data',
+            'doc': ('The stop time of each state.'),
+        },
+        allow_positional=AllowPositional.ERROR,
+    )
+    def add_rows(self, **kwargs):
+        """Add multiple states to this table at once."""
+        _add_recorded_rows(self, 'state_type', **kwargs)
+        self._notify_listeners(np.asarray(kwargs['state_type']))
 
-    def _dict_to_list_conversion(self, **kwargs):
-        data_dict= kwargs['data_dict']
+    add_states = add_rows  # alias for add_rows
 
-        # 1) convert the list of dicts to list of lists containing the names.
-        converted_data=[]
-        for entry in data_dict:
-            converted_data.append(list(itertools.chain.from_iterable([list(i.values()) for i in entry])))
-        return converted_data
+    def _generate_state_end_times(self, **kwargs):
+        """
+        A state stops when the next state of the same trial starts. The End state, and any other state
+        that ends a trial, stops at its own start time.
+        """
+        state_names = kwargs['state_names']
+        start_times = kwargs['start_times']
+        trial_ids = kwargs['trial_ids']
+
+        end_times = np.empty_like(start_times)
+        end_times[:-1] = start_times[1:]
+        last_in_trial = np.ones(len(start_times), dtype=bool)
+        last_in_trial[:-1] = trial_ids[1:] != trial_ids[:-1]
+        stops_at_start = last_in_trial | (state_names == 'End')
+        end_times[stops_at_start] = start_times[stops_at_start]
+        return end_times
 
     def _all_states_validate(self, **kwargs):
-        all_states= kwargs['all_states']
-
-        # 1) convert the list of dicts to list of lists containing the names.
-        converted_data=self._dict_to_list_conversion(data_dict=all_states)
-
-        # 2) validate
-        unique_keys=[]
-        for k,g in itertools.groupby(converted_data):
-            unique_keys.append(k)
-
-        if len(unique_keys)>1:
-            return False
-        else:
-            return True, unique_keys[0]
-
-    @docval(
-        {
-            'name': 'data_path',
-            'type': str,
-            'doc': 'The path to the matlab data file.'
-        }
-    )
+        """
+        Check that the AllStatesList of every trial is the same and return it.
+        """
+        all_states= kwargs['all_states']  # BeadlSession.all_states
+
+        counts = np.diff(all_states['index'], prepend=0)
+        if len(counts) == 0:
+            return True, []
+        if np.any(counts != counts[0]):
+            return False, None
+        names = np.asarray(all_states['state_name']).reshape(len(counts), counts[0])
+        if np.any(names != names[0]):
+            return False, None
+        return True, list(names[0])
+
+    @docval(*populate_from_matlab_docval)
     def populate_from_matlab(self, **kwargs):
         state_types_table = self.state_type.table
-        file_path = kwargs['data_path']
-
-        matlab_file = loadmat(file_path)
-        states_data = matlab_file['BeadlData']['States']
-        offset_times = matlab_file['BeadlData']['SessionMetaData']['TrialStartOffset']
-
+        session = _get_session(**kwargs)
+        states_data = session.states
 
         #validate states_data AllStatesList
-        all_states=[i['AllStatesList'] for i in states_data] # AllStatesList in data['States']
-        validate_bool, unique_keys = self._all_states_validate(all_states=all_states)[0], self._all_states_validate(all_states=all_states)[1]
+        validate_bool, unique_keys = self._all_states_validate(all_states=session.all_states)
 
         if validate_bool:
             #validate state_types from matlab file with task program xml
             state_types_table_data = state_types_table['state_name'].data
             valid = data_program_validator(data = unique_keys, program=state_types_table_data)
             if valid:
-                #retrieve start times
-                updated_start_times=[]
-                trials=[i['TrialPath'] for i in states_data]
-                for trial,time in zip(trials, offset_times):
-                    for state in trial:
-                        new_time=float(state['stateStartTime']+time)
-                        updated_start_times.append(new_time)
-
-                trials_list = self._dict_to_list_conversion(data_dict=trials) # remove the dict structure
-                trials_list_joined=list(itertools.chain.from_iterable(trials_list)) # join the lists
-                start_times = [x for x in trials_list_joined if not isinstance(x, str)] # sort out the state names
+                #flat columns with the states of all trials
+                trial_states = states_data['state_name']
+                trial_ids = np.repeat(np.arange(session.num_trials), session.counts('states'))
+                start_times = states_data['start_time'] + session.row_offsets('states')
 
                 #generate end times
-                end_times = self._generate_state_end_times(trials=trials, offset_times=offset_times)
-
-                #dynamic table region for types todo:
-
-                #formulate a list of states in order from the data
-                trial_states = [x for x in trials_list_joined if isinstance(x, str)] # sort out the times
-
-                #loop over list where we want to find the idx of each element in the state_types_table
-                state_idx_list = []
-                for trial_name in trial_states:
-                    state_type_idx = state_types_table_data.index(trial_name)
-                    state_idx_list.append(state_type_idx)
+                end_times = self._generate_state_end_times(state_names=trial_states,
+                                                           start_times=start_times,
+                                                           trial_ids=trial_ids)
 
-                #create a dynamic table region where the data is the idx
-                region = state_types_table.create_region(name='type', region=state_idx_list, description='idx to the names of states')
-
-                #TODO: Add check of same length for each of the 3 columns prior
+                #find the idx of each element in the state_types_table
+                state_idx_list = state_types_table.encode(trial_states)
 
                 #populate states_table
-                for i in range(len(end_times)):
-                    self.add_row( state_type=region.data[i],start_time=updated_start_times[i], stop_time=end_times[i])
+                self.add_rows(state_type=state_idx_list, start_time=start_times, stop_time=end_times)
 
                 return(self)
 
             else:
-                msg = 'The states from the data does not match possible states from the task program.'
+                msg = ('The states from the data does not match possible states from the task program. '
+                       'Missing states: %s' % valid.summary())
                 raise ValueError(msg)
         else:
             msg = 'The AllStatesList column is invalid. Each entry must match.'
@@ -402,9 +1158,14 @@ class StatesTable(TimeIntervals):
 
 
 @register_class('EventsTable', 'ndx-structured-behavior')
-class EventsTable(DynamicTable):
+class EventsTable(TimeQueryMixin, CategoricalTypeMixin, EncodedValueMixin, DataIOMixin, DynamicTable):
     """A table to hold events data."""
 
+    _type_column = 'event_type'
+    _trials_column = 'events'
+
+    __fields__ = ('timestamp_reference',)
+
     __columns__ = (
         {
             'name': 'timestamp',
@@ -443,12 +1204,35 @@ class EventsTable(DynamicTable):
             'doc': ('The events table.'),
             'default': None
         },
+        {
+            'name': 'encode_values',
+            'type': bool,
+            'doc': ('Store the values as integer codes into the value_elements column, i.e., as an EnumData, '
+                    'instead of storing the text of each value. Use to_categorical_dataframe to read the '
+                    'values without decoding them.'),
+            'default': False
+        },
+        {
+            'name': 'timestamp_reference',
+            'type': str,
+            'doc': ("The time the timestamps are relative to, i.e., 'session_start_time' or 'trial_start_time'. "
+                    "With 'trial_start_time', populate_from_matlab stores the timestamps as float32 offsets from "
+                    "the start_time of their trial in the TrialsTable. Use get_absolute_timestamps to read them."),
+            'default': 'session_start_time',
+            'enum': TIMESTAMP_REFERENCES,
+        },
         allow_positional=AllowPositional.ERROR,
     )
     def __init__(self, **kwargs):
         kwargs['name'] = 'events'
         event_types_table = popargs('event_types_table', kwargs)
+        encode_values, timestamp_reference = popargs('encode_values', 'timestamp_reference', kwargs)
+        if encode_values and kwargs['columns'] is None:
+            kwargs['columns'] = _encoded_value_columns(self.__columns__)
         super().__init__(**kwargs)
+        if not hasattr(self, 'value_elements'):
+            self.value_elements = None  # the optional value_elements dataset of the spec
+        self.timestamp_reference = timestamp_reference
         if event_types_table is not None and self.event_type is not None and self.event_type.table is None:
             self.event_type.table = event_types_table
 
@@ -481,6 +1265,10 @@ class EventsTable(DynamicTable):
         """Add an event to this table."""
         event_type_idx = kwargs['event_type']
         if event_type_idx >= 0 and event_type_idx < len(self.event_type.table):
+            if isinstance(self['value'], EnumData):
+                _add_encoded_row(self, 'event_type', **kwargs)
+                return
+            _check_appendable(self)
             super().add_row(**kwargs)
         else:
             msg = 'Type index is out of bounds'
@@ -490,54 +1278,108 @@ class EventsTable(DynamicTable):
 
     @docval(
         {
-            'name': 'data_path',
-            'type': str,
-            'doc': 'The path to the matlab data file.'
-        }
+            'name': 'timestamp',
+            'type': 'array_data',
+            'doc': ('The event timestamps.'),
+        },
+        {
+            'name': 'event_type',
+            'type': 'array_data',
+            'doc': ('The event type of each event.'),
+        },
+        {
+            'name': 'value',
+            'type': 'array_data',
+            'doc': ('The event values.'),
+        },
+        {
+            'name': 'duration',
+            'type': 'array_data',
+            'doc': ('Duration of each event in seconds.'),
+            'default': None
+        },
+        allow_positional=AllowPositional.ERROR,
     )
+    def add_rows(self, **kwargs):
+        """Add multiple events to this table at once."""
+        _add_recorded_rows(self, 'event_type', **kwargs)
+
+    add_events = add_rows  # alias for add_rows
+
+    @docval(*populate_from_matlab_docval)
     def populate_from_matlab(self, **kwargs):
         event_types_table = self.event_type.table
-        file_path = kwargs['data_path']
-
-        matlab_file = loadmat(file_path)
-        events_data = matlab_file['BeadlData']['Events']
-        offset_times = matlab_file['BeadlData']['SessionMetaData']['TrialStartOffset']
-
-        event_times=[]
-        event_names_data=[]
-        event_value=[]
-        for trial, time in zip(events_data, offset_times):
-            for event in trial['AllEvents']:
-                event_names_data.append(event['eventName'])
-                event_times.append(event['eventTime']+time)
-                event_value.append(event['eventValue'])
-
-        unique_event_names=list(set(event_names_data))
+        session = _get_session(**kwargs)
+        events_data = session.events
+
+        event_names_data = events_data['event_name']
+        event_times = self._session_timestamps(session, 'events')
+        event_value = events_data['value']
+
         event_types_table_data = event_types_table['event_name'].data
 
-        valid = data_program_validator(data = unique_event_names, program=event_types_table_data)
+        valid = data_program_validator(data = event_names_data, program=event_types_table_data)
         if valid:
-            #loop over event_names where we want to find the idx of each element in the event_types_table
-            event_idx_list = []
-            for event_name in event_names_data:
-                event_type_idx = event_types_table_data.index(event_name)
-                event_idx_list.append(event_type_idx)
-
-            #create a dynamic table region where the data is the idx
-            region = event_types_table.create_region(name='event_type', region=event_idx_list, description='idx to the names of events')
+            #find the idx of each element in the event_types_table
+            event_idx_list = event_types_table.encode(event_names_data)
 
             #populate events_table
-            for i in range(len(event_times)):
-                self.add_row(timestamp=event_times[i], event_type=region.data[i], value=event_value[i])
+            self.add_rows(timestamp=event_times, event_type=event_idx_list, value=event_value)
 
             return(self)
         else:
-            msg = 'The events from the data does not match possible events from the task program.'
+            msg = ('The events from the data does not match possible events from the task program. '
+                   'Missing events: %s' % valid.summary())
+            raise ValueError(msg)
+
+
+class TypesTableMixin():
+    """
+    Map the names in a StateTypesTable, EventTypesTable or ActionTypesTable to the index of their row.
+
+    The name to index mapping is built on first use, e.g., for a table read from a file, and is kept
+    current when rows are added with add_row.
+    """
+
+    _name_column = None  # the column with the names of the types, e.g., 'state_name'
+
+    def _get_name_to_id(self):
+        if getattr(self, '_name_to_id', None) is None:
+            self._name_to_id = dict()
+            for idx, name in enumerate(self[self._name_column].data[:]):
+                self._name_to_id.setdefault(name, idx)  # the first row with the name, the same as list.index
+        return self._name_to_id
+
+    @docval(*get_docval(DynamicTable.add_row), allow_extra=True)
+    def add_row(self, **kwargs):
+        """Add a type to this table."""
+        super().add_row(**kwargs)
+        if getattr(self, '_name_to_id', None) is not None:
+            self._name_to_id.setdefault(self[self._name_column].data[-1], len(self) - 1)
+
+    def encode(self, names):
+        """
+        Return the row index of the type with each of the given names as an array of int.
+
+        names: An array of type names, e.g., the recorded event names
+
+        Raises a ValueError if a name is not in the table.
+        """
+        if isinstance(names, pd.Categorical):
+            # resolve each category once, e.g., for the names of a BeadlSession
+            return self.encode(np.asarray(names.categories, dtype=object))[names.codes]
+        codes, unique_names = pd.factorize(np.asarray(names, dtype=object).ravel())
+        name_to_id = self._get_name_to_id()
+        missing = [name for name in unique_names if name not in name_to_id]
+        if len(missing) > 0:
+            msg = 'The names %s are not in the %s.' % (missing, self.name)
             raise ValueError(msg)
+        unique_ids = np.fromiter((name_to_id[name] for name in unique_names), dtype=np.int64, count=len(unique_names))
+        return unique_ids[codes].reshape(np.shape(names))
 
 
 @register_class('StateTypesTable', 'ndx-structured-behavior')
-class StateTypesTable(DynamicTable):
+class StateTypesTable(TypesTableMixin, DynamicTable):
     __columns__ = (
         {
         'name': 'state_name',
@@ -546,6 +1388,8 @@ class StateTypesTable(DynamicTable):
         },
     )
 
+    _name_column = 'state_name'
+
     @docval(
         *get_docval(DynamicTable.__init__, 'id', 'columns', 'colnames'),
         {
@@ -573,15 +1417,13 @@ class StateTypesTable(DynamicTable):
             self._populate_from_program()
 
     def _populate_from_program(self):
-        parsed_xml_object = BeadlXMLParser(string=self.beadl_task_program.data)
-        element=parsed_xml_object.element(element_name='BeadlStates')
-        parsed_states = parsed_xml_object._parse_protocal_children(element=element)
+        parsed_program = parse_beadl_program(self.beadl_task_program.data)
 
-        for state in parsed_states['BeadlState']:
-            super().add_row(state_name=state['name'])
+        for state_name in parsed_program.states:
+            super().add_row(state_name=state_name)
 
 @register_class('EventTypesTable', 'ndx-structured-behavior')
-class EventTypesTable(DynamicTable):
+class EventTypesTable(TypesTableMixin, DynamicTable):
     __columns__ = (
         {
         'name': 'event_name',
@@ -590,6 +1432,8 @@ class EventTypesTable(DynamicTable):
         },
     )
 
+    _name_column = 'event_name'
+
     @docval(
         *get_docval(DynamicTable.__init__, 'id', 'columns', 'colnames'),
         {
@@ -616,30 +1460,14 @@ class EventTypesTable(DynamicTable):
             self._populate_from_program()
 
     def _populate_from_program(self):
-        parsed_xml_object = BeadlXMLParser(string=self.beadl_task_program.data)
-
-        # HardwareEvents
-        element=parsed_xml_object.element(element_name='BeadlEvents')
-        parsed_states = parsed_xml_object._parse_protocal_children(element=element)
-        hardware_events = parsed_states['HardwareEvent']
-
-        # Events within states
-        element=parsed_xml_object.element(element_name='BeadlStates')
-        parsed_states = parsed_xml_object._parse_protocal_children(element=element)
-        possible_events = ['ExternalEvent', 'TimerEvent', 'ArgumentEvent', 'VariableEvent', 'TimeSpanEvent']
-
-        events_from_states=[]
-        for event in possible_events:
-            events_from_states+=(parsed_states[event])
+        # HardwareEvents and the events within states
+        parsed_program = parse_beadl_program(self.beadl_task_program.data)
 
-        # joined events
-        joined_events = hardware_events+events_from_states
-
-        for event_name in set([event['eventName'] for event in joined_events]):
+        for event_name in parsed_program.events:
             super().add_row(event_name=event_name)
 
 @register_class('ActionTypesTable', 'ndx-structured-behavior')
-class ActionTypesTable(DynamicTable):
+class ActionTypesTable(TypesTableMixin, DynamicTable):
     __columns__ = (
         {
         'name': 'action_name',
@@ -648,6 +1476,8 @@ class ActionTypesTable(DynamicTable):
         },
     )
 
+    _name_column = 'action_name'
+
     @docval(
         *get_docval(DynamicTable.__init__, 'id', 'columns', 'colnames'),
         {
@@ -674,22 +1504,20 @@ class ActionTypesTable(DynamicTable):
             self._populate_from_program()
 
     def _populate_from_program(self):
-        parsed_xml_object = BeadlXMLParser(string=self.beadl_task_program.data)
-        element=parsed_xml_object.element(element_name='BeadlStates')
-        parsed_states = parsed_xml_object._parse_protocal_children(element=element)
-        possible_actions = ['OutputAction', 'SetVariableAction', 'CallbackAction']
+        # actions within states
+        parsed_program = parse_beadl_program(self.beadl_task_program.data)
 
-        actions_from_states=[]
-        for action in possible_actions:
-            actions_from_states+=(parsed_states[action])
+        for action_name in parsed_program.actions:
+            super().add_row(action_name=action_name)
 
 
-        for action in set([action['actionName'] for action in actions_from_states]):
-            super().add_row(action_name=action)
+@register_class('ActionsTable', 'ndx-structured-behavior')
+class ActionsTable(TimeQueryMixin, CategoricalTypeMixin, EncodedValueMixin, DataIOMixin, DynamicTable):
+    _type_column = 'action_type'
+    _trials_column = 'actions'
 
+    __fields__ = ('timestamp_reference',)
 
-@register_class('ActionsTable', 'ndx-structured-behavior')
-class ActionsTable(DynamicTable):
     __columns__ = (
         {
             'name': 'timestamp',
@@ -728,12 +1556,35 @@ class ActionsTable(DynamicTable):
             'doc': ('The ActionTypesTable.'),
             'default': None
         },
+        {
+            'name': 'encode_values',
+            'type': bool,
+            'doc': ('Store the values as integer codes into the value_elements column, i.e., as an EnumData, '
+                    'instead of storing the text of each value. Use to_categorical_dataframe to read the '
+                    'values without decoding them.'),
+            'default': False
+        },
+        {
+            'name': 'timestamp_reference',
+            'type': str,
+            'doc': ("The time the timestamps are relative to, i.e., 'session_start_time' or 'trial_start_time'. "
+                    "With 'trial_start_time', populate_from_matlab stores the timestamps as float32 offsets from "
+                    "the start_time of their trial in the TrialsTable. Use get_absolute_timestamps to read them."),
+            'default': 'session_start_time',
+            'enum': TIMESTAMP_REFERENCES,
+        },
         allow_positional=AllowPositional.ERROR,
     )
     def __init__(self, **kwargs):
         kwargs['name'] = 'actions'
         action_types_table = popargs('action_types_table', kwargs)
+        encode_values, timestamp_reference = popargs('encode_values', 'timestamp_reference', kwargs)
+        if encode_values and kwargs['columns'] is None:
+            kwargs['columns'] = _encoded_value_columns(self.__columns__)
         super().__init__(**kwargs)
+        if not hasattr(self, 'value_elements'):
+            self.value_elements = None  # the optional value_elements dataset of the spec
+        self.timestamp_reference = timestamp_reference
         if action_types_table is not None and self.action_type is not None and self.action_type.table is None:
             self.action_type.table = action_types_table
 
@@ -766,6 +1617,10 @@ class ActionsTable(DynamicTable):
         """Add an event to this table."""
         action_type_idx = kwargs['action_type']
         if action_type_idx >= 0 and action_type_idx < len(self.action_type.table):
+            if isinstance(self['value'], EnumData):
+                _add_encoded_row(self, 'action_type', **kwargs)
+                return
+            _check_appendable(self)
             super().add_row(**kwargs)
         else:
             msg = 'Type index is out of bounds'
@@ -775,52 +1630,58 @@ class ActionsTable(DynamicTable):
 
     @docval(
         {
-            'name': 'data_path',
-            'type': str,
-            'doc': 'The path to the matlab data file.'
-        }
+            'name': 'timestamp',
+            'type': 'array_data',
+            'doc': ('The action timestamps.'),
+        },
+        {
+            'name': 'action_type',
+            'type': 'array_data',
+            'doc': ('The action type of each action.'),
+        },
+        {
+            'name': 'value',
+            'type': 'array_data',
+            'doc': ('The action values.'),
+        },
+        {
+            'name': 'duration',
+            'type': 'array_data',
+            'doc': ('Duration of each action in seconds.'),
+            'default': None
+        },
+        allow_positional=AllowPositional.ERROR,
     )
+    def add_rows(self, **kwargs):
+        """Add multiple actions to this table at once."""
+        _add_recorded_rows(self, 'action_type', **kwargs)
+
+    add_actions = add_rows  # alias for add_rows
+
+    @docval(*populate_from_matlab_docval)
     def populate_from_matlab(self, **kwargs):
         action_types_table = self.action_type.table
-        file_path = kwargs['data_path'] # data
-
-        matlab_file = loadmat(file_path)
-        states_data = matlab_file['BeadlData']['States']
-        offset_times = matlab_file['BeadlData']['SessionMetaData']['TrialStartOffset']
-
-        action_times=[]
-        action_names_data=[]
-        action_value=[]
-        for trial, time in zip(states_data, offset_times):
-            trial_actions=trial['StateOutputActions']
-            if type(trial_actions)!= list:
-                trial_actions=[trial_actions]
-            for action in trial_actions:
-                action_names_data.append(action['actionName'])
-                action_times.append(float(action['actionTime'])+time)
-                action_value.append(action['actionValue'])
+        session = _get_session(**kwargs)
+        actions_data = session.actions
+
+        action_names_data = actions_data['action_name']
+        action_times = self._session_timestamps(session, 'actions')
+        action_value = actions_data['value']
 
         #validate set-up
-        unique_action_names=list(set(action_names_data))
         action_types_table_data = action_types_table['action_name'].data
 
-        valid = data_program_validator(data = unique_action_names, program=action_types_table_data)
+        valid = data_program_validator(data = action_names_data, program=action_types_table_data)
 
         if valid:
-            #loop over event_names where we want to find the idx of each element in the event_types_table
-            action_idx_list = []
-            for action_name in action_names_data:
-                action_type_idx = action_types_table_data.index(action_name)
-                action_idx_list.append(action_type_idx)
+            #find the idx of each element in the action_types_table
+            action_idx_list = action_types_table.encode(action_names_data)
 
-            #create a dynamic table region where the data is the idx
-            region = action_types_table.create_region(name='action_type', region=action_idx_list, description='idx to the names of actions')
-
-            #populate events_table
-            for i in range(len(action_times)):
-                self.add_row(action_type=region.data[i], value=action_value[i], timestamp=action_times[i])
+            #populate actions_table
+            self.add_rows(action_type=action_idx_list, value=action_value, timestamp=action_times)
 
             return(self)
         else:
-            msg = 'The actions from the data does not match possible actions from the task program.'
+            msg = ('The actions from the data does not match possible actions from the task program. '
+                   'Missing actions: %s' % valid.summary())
             raise ValueError(msg)
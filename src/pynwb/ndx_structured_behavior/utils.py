@@ -14,7 +14,7 @@ def loadmat(filename):
         todict is called to change them to nested dictionaries
         '''
         for key in d:
-            if isinstance(d[key], spio.matlab.mio5_params.mat_struct):
+            if isinstance(d[key], spio.matlab.mat_struct):
                 d[key] = _todict(d[key])
         return d
 
@@ -25,7 +25,7 @@ def loadmat(filename):
         d = {}
         for strg in matobj._fieldnames:
             elem = matobj.__dict__[strg]
-            if isinstance(elem, spio.matlab.mio5_params.mat_struct):
+            if isinstance(elem, spio.matlab.mat_struct):
                 d[strg] = _todict(elem)
             elif isinstance(elem, np.ndarray):
                 d[strg] = _tolist(elem)
@@ -41,7 +41,7 @@ def loadmat(filename):
         '''
         elem_list = []
         for sub_elem in ndarray:
-            if isinstance(sub_elem, spio.matlab.mio5_params.mat_struct):
+            if isinstance(sub_elem, spio.matlab.mat_struct):
                 elem_list.append(_todict(sub_elem))
             elif isinstance(sub_elem, np.ndarray):
                 elem_list.append(_tolist(sub_elem))
@@ -50,3 +50,22 @@ def loadmat(filename):
         return elem_list
     data = spio.loadmat(filename, struct_as_record=False, squeeze_me=True)
     return _check_keys(data)
+
+
+def loadmat_records(filename):
+    '''
+    Load a mat file with MATLAB structs as NumPy structured arrays. Unlike loadmat, the
+    structs are not converted to nested dictionaries so that fields of struct arrays can
+    be read as whole columns, e.g., records['eventName'].
+    '''
+    return spio.loadmat(filename, struct_as_record=True, squeeze_me=True)
+
+
+def record_value(record, field):
+    '''
+    Return the value of a field of a (squeezed) MATLAB struct loaded by loadmat_records.
+    '''
+    value = record[field]
+    if isinstance(value, np.ndarray) and value.shape == () and value.dtype == object:
+        return value[()]
+    return value
@@ -1,5 +1,6 @@
 from ndx_structured_behavior import (Task, BEADLTaskProgram, BEADLTaskSchema, EventTypesTable, EventsTable,
                        StateTypesTable, StatesTable, TrialsTable, ActionTypesTable, ActionsTable, TaskArgumentsTable)
+from ndx_structured_behavior import BeadlSession
 from ndx_structured_behavior.beadl_xml_parser import BeadlXMLParser
 from pynwb import NWBHDF5IO
 from pynwb.file import NWBFile, Subject
@@ -54,18 +55,20 @@ task = Task(
     task_arguments=task_arg_table
 )
 
-# Create Events, Actions, and States
+# Load the BEADL data once and create Events, Actions, and States
+beadl_session = BeadlSession.from_matlab(beadl_data_file)
+
 events = EventsTable(description="description", event_types_table=event_types)
-_ = events.populate_from_matlab(data_path=beadl_data_file)
+_ = events.populate_from_matlab(session=beadl_session)
 
 actions = ActionsTable(description="description", action_types_table=action_types)
-_ = actions.populate_from_matlab(data_path=beadl_data_file)
+_ = actions.populate_from_matlab(session=beadl_session)
 
 states = StatesTable(description="description", state_types_table=state_types)
-_ = states.populate_from_matlab(data_path=beadl_data_file)
+_ = states.populate_from_matlab(session=beadl_session)
 
 trials = TrialsTable(description="description", states_table=states, events_table=events, actions_table=actions)
-_ = trials.populate_from_matlab(data_path=beadl_data_file)
+_ = trials.populate_from_matlab(session=beadl_session)
 
 # Create NWBFile
 nwbfile = NWBFile(
@@ -81,6 +84,10 @@ nwbfile.add_acquisition(events)
 nwbfile.add_acquisition(actions)
 nwbfile.trials = trials
 
+# Chunk and compress the columns. Without this call, the tables are written contiguous and uncompressed.
+for table in (states, events, actions, trials):
+    table.configure_dataio()
+
 # Write the NWBFile
 with NWBHDF5IO(nwb_filepath, mode="w") as io:
     io.write(nwbfile)
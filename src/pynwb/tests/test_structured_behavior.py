@@ -1,11 +1,19 @@
 import datetime
 import numpy as np
+import pandas as pd
 import os
+import shutil
 import subprocess
 import sys
+import queue
+import tempfile
+from unittest import mock
 
+import matplotlib
+from matplotlib import pyplot as plt
 from pynwb import NWBHDF5IO, NWBFile
 from pynwb.core import DynamicTableRegion
+from hdmf.common.table import EnumData
 from pynwb.device import Device
 from pynwb.ecephys import ElectrodeGroup
 from pynwb.file import ElectrodeTable as get_electrode_table
@@ -13,8 +21,13 @@ from pynwb.testing import TestCase, remove_test_file, AcquisitionH5IOMixin
 
 from ndx_structured_behavior import (TaskRecording, Task, BEADLTaskProgram, BEADLTaskSchema, EventTypesTable, EventsTable,
                        StateTypesTable, StatesTable, TrialsTable, ActionTypesTable, ActionsTable,
-                       TaskArgumentsTable, data_program_validator)
-from ndx_structured_behavior.plot import show_by_type_and_value
+                       TaskArgumentsTable, BeadlSession, data_program_validator)
+from ndx_structured_behavior.beadl_xml_parser import BeadlXMLParser, parse_beadl_program, clear_program_cache
+from ndx_structured_behavior.convert import find_sessions, convert_session, convert_directory, main as convert_main
+from ndx_structured_behavior.streaming import StreamingWriter, StreamedTrial, queue_source
+from ndx_structured_behavior.plot import (show_by_type_and_value, plot_trials, plot_events, plot_markers,
+                                          compute_state_transition_matrix, StateTransitionAccumulator,
+                                          compute_state_ngrams, plot_state_transition_graph, clear_layout_cache)
 
 
 
@@ -34,6 +47,24 @@ def set_up_nwbfile():
     return nwbfile
 
 
+def fake_trial_source(event_names, num_trials, seed=0, events_per_trial=None):
+    """Yield StreamedTrial with random events, like a rig, with the type of each event given by its name."""
+    rng = np.random.default_rng(seed)
+    for trial in range(num_trials):
+        start_time = float(trial)
+        num_events = int(rng.integers(0, 4)) if events_per_trial is None else events_per_trial
+        yield StreamedTrial(
+            start_time=start_time,
+            stop_time=start_time + 0.8,
+            states=dict(state_type=[0, 1], start_time=[start_time, start_time + 0.4],
+                        stop_time=[start_time + 0.4, start_time + 0.8]),
+            events=dict(event_type=rng.choice(event_names, num_events),
+                        timestamp=start_time + np.sort(rng.random(num_events)) * 0.8,
+                        value=rng.choice(["in", "out"], num_events)),
+            actions=dict(action_type=[0], timestamp=[start_time + 0.1], value=["on"]),
+        )
+
+
 class TestHelperFunctions(TestCase):
     """Test for helper functions"""
     def setUp(self):
@@ -48,6 +79,61 @@ class TestHelperFunctions(TestCase):
         data = ['a', 'd']
         self.assertFalse(data_program_validator(data, self.program))
 
+    def test_data_program_validator_report(self):
+        data = np.array(['a', 'e', 'd', 'b', 'e'])
+        result = data_program_validator(data, np.array(self.program))
+
+        self.assertFalse(result.valid)
+        np.testing.assert_array_equal(result.missing, ['d', 'e'])
+        np.testing.assert_array_equal(result.counts, [1, 2])
+        self.assertEqual(result.summary(), 'd (1), e (2)')
+
+    def test_data_program_validator_categorical(self):
+        data = pd.Series(pd.Categorical(['a', 'e', 'e'], categories=['a', 'd', 'e']))
+        result = data_program_validator(data, self.program)
+
+        np.testing.assert_array_equal(result.missing, ['e'])
+        np.testing.assert_array_equal(result.counts, [2])
+
+    def test_data_program_validator_codes(self):
+        self.assertTrue(data_program_validator(np.array([0, 2, 2, 1]), np.arange(3)))
+
+    def test_parse_beadl_program_cache(self):
+        with open(BEADL_TASK_PROGRAM_FILE, "r") as test_xml_file:
+            test_xml = test_xml_file.read()
+
+        clear_program_cache()
+        parsed = parse_beadl_program(test_xml)
+        self.assertIs(parse_beadl_program(test_xml), parsed)
+        self.assertEqual(parsed.events, ('CorrectPortPoke', 'ErrorPort1Poke', 'ErrorPort2Poke', 'stateTimer'))
+        self.assertEqual(parsed.actions, ('CorrectPortLED', 'CorrectPortValve'))
+        self.assertEqual(len(parsed.arguments), 5)
+        # the cached arguments are shared and cannot be changed by one of the tables
+        with self.assertRaises(TypeError):
+            parsed.arguments[0]['name'] = 'changed'
+
+        clear_program_cache()
+        self.assertIsNot(parse_beadl_program(test_xml), parsed)
+        self.assertEqual(parse_beadl_program(test_xml), parsed)
+
+    def test_beadl_xml_parser_lookups(self):
+        with open(BEADL_TASK_PROGRAM_FILE, "r") as test_xml_file:
+            parser = BeadlXMLParser(string=test_xml_file.read())
+
+        self.assertEqual(parser.element(element_name='BeadlStates').tag, 'BeadlStates')
+        self.assertIsNone(parser.element(element_name='NotAnElement'))
+
+        reward = parser.retrieve_state_type('Reward')
+        self.assertEqual(reward['OutputAction'][0]['actionName'], 'CorrectPortValve')
+        self.assertIs(parser.retrieve_state_type('Reward'), reward)
+        self.assertEqual(len(parser.retrieve_event_type('stateTimer')), 3)
+        self.assertEqual(parser.retrieve_action_type('CorrectPortLED')[0]['actionValue'], 'on')
+
+        with self.assertRaisesWith(ValueError, "The state 'NotAState' is not in the task program."):
+            parser.retrieve_state_type('NotAState')
+        with self.assertRaises(ValueError):
+            parser.retrieve_event_type('NotAnEvent')
+
 
 class TestExampleScript(TestCase):
     """Test running the example script"""
@@ -76,6 +162,295 @@ class TestExampleScript(TestCase):
             self.assertEqual(len(nwbfile.acquisition['states']), 612)
             self.assertEqual(len(nwbfile.trials), 153)
 
+
+def exit_worker(files, nwb_path, encode_values):
+    """Stop the worker process without a result, like a worker that is killed by the OS."""
+    os._exit(1)
+
+
+class TestConvert(TestCase):
+    """Test converting a directory of BEADL sessions"""
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.input_dir, "nwb")
+        for filename in (BEADL_TASK_SCHEMA_FILE, BEADL_TASK_PROGRAM_FILE, BEADL_DATA_FILE):
+            shutil.copy(filename, self.input_dir)
+        with open(os.path.join(self.input_dir, "broken.mat"), "w") as broken_file:
+            broken_file.write("not a mat file")
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+
+    def test_find_sessions(self):
+        sessions, unmatched = find_sessions(self.input_dir)
+        self.assertEqual([os.path.basename(files.data) for files in sessions], ["BeadlDataSample.mat", "broken.mat"])
+        self.assertEqual(os.path.basename(sessions[0].program), "LightChasingTask.xml")
+        self.assertEqual(os.path.basename(sessions[0].schema), "BEADL.xsd")
+        self.assertEqual(unmatched, [])
+
+    def test_convert_directory(self):
+        messages = []
+        results = convert_directory(self.input_dir, output_dir=self.output_dir, jobs=2, encode_values=True,
+                                    log=messages.append)
+
+        errors = {os.path.basename(result.files.data): result.error for result in results}
+        self.assertIsNone(errors["BeadlDataSample.mat"])
+        self.assertIsNotNone(errors["broken.mat"])
+        self.assertEqual(len(messages), 3)
+        with NWBHDF5IO(os.path.join(self.output_dir, "BeadlDataSample.nwb"), "r") as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").events), 7695)
+            self.assertEqual(len(nwbfile.trials), 153)
+
+        # no partial NWB file is left for the broken session
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["BeadlDataSample.nwb"])
+
+        # existing NWB files are skipped
+        messages = []
+        results = convert_directory(self.input_dir, output_dir=self.output_dir, log=messages.append)
+        self.assertEqual([os.path.basename(result.files.data) for result in results], ["broken.mat"])
+        self.assertTrue(messages[0].startswith("Skipping %s" % os.path.join(self.input_dir, "BeadlDataSample.mat")))
+        self.assertEqual(convert_main(["convert", self.input_dir, "--output-dir", self.output_dir, "--jobs", "1"]), 1)
+
+    def test_convert_directory_broken_pool(self):
+        messages = []
+        with mock.patch("ndx_structured_behavior.convert._convert_worker", exit_worker):
+            results = convert_directory(self.input_dir, output_dir=self.output_dir, jobs=2, log=messages.append)
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertTrue(result.error.startswith("BrokenProcessPool"))
+        self.assertTrue(messages[-1].startswith("Converted 0 of 2 sessions"))
+
+    def test_convert_session_write_error(self):
+        sessions, _ = find_sessions(self.input_dir)
+        nwb_path = os.path.join(self.input_dir, "BeadlDataSample.nwb")
+        with mock.patch.object(NWBHDF5IO, "write", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                convert_session(sessions[0], nwb_path)
+        self.assertFalse(os.path.exists(nwb_path))
+        self.assertFalse(os.path.exists(nwb_path + ".tmp"))
+
+    def test_append_to_converted_session(self):
+        sessions, _ = find_sessions(self.input_dir)
+        nwb_path = os.path.join(self.input_dir, "BeadlDataSample.nwb")
+        convert_session(sessions[0], nwb_path)
+
+        with NWBHDF5IO(nwb_path, "a") as io:
+            nwbfile = io.read()
+            arguments = {name: nwbfile.trials[name].data[-1:] for name in nwbfile.trials.colnames
+                         if name not in ("start_time", "stop_time", "states", "events", "actions")}
+            nwbfile.trials.append_trials(start_time=[5000.0], stop_time=[5001.0], num_states=[1], num_events=[0],
+                                         num_actions=[0], states=dict(state_type=[0], start_time=[5000.0],
+                                                                      stop_time=[5001.0]), **arguments)
+        with NWBHDF5IO(nwb_path, "r") as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.trials), 154)
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").states), 613)
+            self.assertEqual(nwbfile.trials.to_dataframe().shape, (154, 10))
+
+
+class TestStreamingWriter(TestCase):
+    """Test writing the trials of a live session"""
+    def setUp(self):
+        with open(BEADL_TASK_SCHEMA_FILE, "r") as test_xsd_file:
+            test_xsd = test_xsd_file.read()
+        with open(BEADL_TASK_PROGRAM_FILE, "r") as test_xml_file:
+            test_xml = test_xml_file.read()
+        task_schema = BEADLTaskSchema(name="task_schema", data=test_xsd, version="0.1.0", language="XSD")
+        task_program = BEADLTaskProgram(name="task_program", data=test_xml, schema=task_schema, language="XML")
+        self.task = Task(
+            task_program=task_program,
+            task_schema=task_schema,
+            event_types=EventTypesTable(description="description", beadl_task_program=task_program,
+                                        populate_from_program=True),
+            state_types=StateTypesTable(description="description", beadl_task_program=task_program,
+                                        populate_from_program=True),
+            action_types=ActionTypesTable(description="description", beadl_task_program=task_program,
+                                          populate_from_program=True),
+            task_arguments=TaskArgumentsTable(beadl_task_program=task_program, populate_from_program=True),
+        )
+        self.event_names = self.task.event_types["event_name"][:]
+        self.path = "test_streaming.nwb"
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_streaming_writer(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=7))
+        writer = StreamingWriter(path=self.path, nwbfile=set_up_nwbfile(), task=self.task, flush_trials=2,
+                                 chunk_rows=4, encode_values=True)
+        for trial in trials[:5]:
+            writer.add_trial(trial)
+
+        # the file has the trials of each flush while the session is running
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.trials), 4)
+            self.assertEqual(nwbfile.trials["start_time"].data.maxshape, (None,))
+            self.assertEqual(nwbfile.trials["events_index"].data.chunks, (4,))
+
+        trial_queue = queue.Queue()
+        for trial in trials[5:]:
+            trial_queue.put(trial)
+        trial_queue.put(None)
+        with writer:
+            writer.write_stream(queue_source(trial_queue))
+        self.assertEqual(writer.num_trials, 7)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            events = nwbfile.get_acquisition("task_recording").events
+            self.assertEqual(len(nwbfile.trials), 7)
+            np.testing.assert_array_equal(nwbfile.trials["start_time"].data[:], np.arange(7))
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").states), 14)
+            self.assertEqual(len(events), sum(len(trial.events["timestamp"]) for trial in trials))
+            for index, trial in enumerate(trials):
+                trial_events = nwbfile.trials.trial_events(trial=index)
+                np.testing.assert_array_equal(trial_events["timestamp"], trial.events["timestamp"])
+                event_types = np.asarray(events["event_type"].data[:])[trial_events.index]
+                np.testing.assert_array_equal(np.asarray(self.event_names)[event_types], trial.events["event_type"])
+            values = np.concatenate([trial.events["value"] for trial in trials])
+            np.testing.assert_array_equal(events.to_categorical_dataframe()["value"], values)
+
+    def test_streaming_writer_empty_trials(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=6, seed=4, events_per_trial=2))
+        no_actions = dict(action_type=[], timestamp=[], value=[])
+        no_states = dict(state_type=[], start_time=[], stop_time=[])
+        no_events = dict(event_type=[], timestamp=[], value=[])
+        trials[0] = trials[0]._replace(actions=no_actions)
+        trials[1] = trials[1]._replace(events=no_events, states=no_states)
+        # a flush in which no trial has actions
+        trials[3] = trials[3]._replace(actions=no_actions)
+        trials[4] = trials[4]._replace(actions=no_actions)
+        with StreamingWriter(path=self.path, nwbfile=set_up_nwbfile(), task=self.task, flush_trials=3,
+                             encode_values=True) as writer:
+            writer.write_stream(trials)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            recording = nwbfile.get_acquisition("task_recording")
+            self.assertEqual(len(nwbfile.trials), 6)
+            self.assertEqual(list(nwbfile.trials["states_index"].data[:]), [2, 2, 4, 6, 8, 10])
+            self.assertEqual(list(nwbfile.trials["events_index"].data[:]), [2, 2, 4, 6, 8, 10])
+            self.assertEqual(list(nwbfile.trials["actions_index"].data[:]), [0, 1, 2, 2, 2, 3])
+            self.assertEqual(list(recording.actions.to_categorical_dataframe()["value"]), ["on"] * 3)
+            np.testing.assert_array_equal(nwbfile.trials.trial_events(trial=2)["timestamp"],
+                                          trials[2].events["timestamp"])
+
+    def test_streaming_writer_past_uint8(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=5, events_per_trial=100))
+        with StreamingWriter(path=self.path, nwbfile=set_up_nwbfile(), task=self.task, flush_trials=1) as writer:
+            writer.write_stream(trials)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.trials), 5)
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").events), 500)
+            self.assertEqual(list(nwbfile.trials["events_index"].data[:]), [100, 200, 300, 400, 500])
+            np.testing.assert_array_equal(nwbfile.trials.trial_events(trial=4)["timestamp"],
+                                          trials[4].events["timestamp"])
+
+    def _write_session(self, trials, appendable):
+        events = EventsTable(description="description", event_types_table=self.task.event_types)
+        actions = ActionsTable(description="description", action_types_table=self.task.action_types)
+        states = StatesTable(description="description", state_types_table=self.task.state_types)
+        trials_table = TrialsTable(description="description", states_table=states, events_table=events,
+                                   actions_table=actions)
+        for trial in trials:
+            trials_table.append_trials(start_time=[trial.start_time], stop_time=[trial.stop_time],
+                                       states=trial.states, num_states=[2],
+                                       events=dict(trial.events,
+                                                   event_type=self.task.event_types.encode(trial.events["event_type"])),
+                                       num_events=[len(trial.events["timestamp"])],
+                                       actions=trial.actions, num_actions=[1])
+        if appendable:
+            for table in (events, actions, states, trials_table):
+                table.configure_dataio(appendable=True)
+        nwbfile = set_up_nwbfile()
+        nwbfile.add_lab_meta_data(self.task)
+        nwbfile.add_acquisition(TaskRecording(events=events, states=states, actions=actions))
+        nwbfile.trials = trials_table
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+    def test_append_trials(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=5, seed=1))
+        self._write_session(trials[:3], appendable=True)
+
+        new_events = [trial.events for trial in trials[3:]]
+        with NWBHDF5IO(self.path, mode="a") as io:
+            nwbfile = io.read()
+            nwbfile.trials.append_trials(
+                start_time=[3.0, 4.0], stop_time=[3.8, 4.8],
+                states=dict(state_type=[0, 1, 0, 1], start_time=[3.0, 3.4, 4.0, 4.4], stop_time=[3.4, 3.8, 4.4, 4.8]),
+                num_states=[2, 2],
+                events=dict(event_type=nwbfile.lab_meta_data["task"].event_types.encode(
+                                np.concatenate([events["event_type"] for events in new_events])),
+                            timestamp=np.concatenate([events["timestamp"] for events in new_events]),
+                            value=np.concatenate([events["value"] for events in new_events])),
+                num_events=[len(events["timestamp"]) for events in new_events],
+                num_actions=[0, 0],
+            )
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.trials), 5)
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").states), 10)
+            self.assertEqual(list(nwbfile.trials["states_index"].data[:]), [2, 4, 6, 8, 10])
+            self.assertEqual(nwbfile.trials.trial_states(trial=4, df=False), slice(8, 10))
+            np.testing.assert_array_equal(nwbfile.trials.trial_events(trial=4)["timestamp"],
+                                          trials[4].events["timestamp"])
+            # the trials without actions
+            self.assertEqual(list(nwbfile.trials["actions_index"].data[:]), [1, 2, 3, 3, 3])
+
+    def test_append_trials_past_uint8(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=3, seed=2))
+        self._write_session(trials, appendable=True)
+
+        # the offsets of the events of the new trials do not fit the uint8 offsets of a VectorIndex in memory
+        num_events = [150, 150]
+        rng = np.random.default_rng(3)
+        with NWBHDF5IO(self.path, mode="a") as io:
+            nwbfile = io.read()
+            num_existing = len(nwbfile.get_acquisition("task_recording").events)
+            nwbfile.trials.append_trials(
+                start_time=[3.0, 4.0], stop_time=[3.8, 4.8], num_states=[0, 0], num_actions=[0, 0],
+                events=dict(event_type=rng.integers(0, len(self.event_names), 300),
+                            timestamp=np.linspace(3.0, 4.8, 300), value=rng.choice(["in", "out"], 300)),
+                num_events=num_events,
+            )
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            nwbfile = io.read()
+            self.assertEqual(nwbfile.trials["events_index"].data.dtype, np.uint32)
+            self.assertEqual(len(nwbfile.trials), 5)
+            self.assertEqual(list(nwbfile.trials["events_index"].data[3:]), [num_existing + 150, num_existing + 300])
+            np.testing.assert_array_equal(nwbfile.trials.trial_events(trial=4)["timestamp"],
+                                          np.linspace(3.0, 4.8, 300)[150:])
+            self.assertEqual(len(nwbfile.trials.to_dataframe()), 5)
+
+    def test_append_trials_not_appendable(self):
+        trials = list(fake_trial_source(self.event_names, num_trials=2))
+        self._write_session(trials[:1], appendable=False)
+        trial = trials[1]
+        for mode in ("a", "r"):
+            with NWBHDF5IO(self.path, mode=mode) as io:
+                nwbfile = io.read()
+                with self.assertRaisesWith(ValueError, "Cannot append rows to trials because " +
+                                           ("the dataset '/intervals/trials/id' is not resizable. "
+                                            "Write the table with configure_dataio(appendable=True) to append rows "
+                                            "to the file." if mode == "a" else
+                                            "its file is not open for writing. Open the file with "
+                                            "NWBHDF5IO(path, mode='a').")):
+                    nwbfile.trials.append_trials(start_time=[1.0], stop_time=[1.8], states=trial.states, num_states=[2],
+                                                 num_events=[0], num_actions=[0])
+        with NWBHDF5IO(self.path, mode="r") as io:
+            nwbfile = io.read()
+            self.assertEqual(len(nwbfile.trials), 1)
+            self.assertEqual(len(nwbfile.get_acquisition("task_recording").states), 2)
+
+
 class TestBEADLProgramConstructors(TestCase):
     # TODO split into separate tests
 
@@ -264,6 +639,341 @@ class TestBeadlTablesPopulate(TestCase):
         self.assertEqual(states.to_dataframe().shape, (612, 3))
         self.assertEqual(trials.to_dataframe().shape, (153, 10))
 
+    def test_populate_from_session(self):
+        session = BeadlSession.from_matlab(self.beadl_data)
+        self.assertEqual(session.num_trials, 153)
+        self.assertEqual(session.events['index'][-1], 7695)
+        self.assertEqual(len(session.events['event_name']), 7695)
+        self.assertEqual(len(session.actions['timestamp']), 251)
+        self.assertEqual(len(session.states['start_time']), 612)
+
+        action_types = ActionTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                        populate_from_program=True)
+        actions = ActionsTable(description="description", action_types_table=action_types)
+        actions.populate_from_matlab(session=session)
+
+        event_types = EventTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        events = EventsTable(description="description", event_types_table=event_types)
+        events.populate_from_matlab(session=session)
+
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.populate_from_matlab(session=session)
+
+        trials = TrialsTable(description="description", states_table=states, events_table=events, actions_table=actions)
+        trials.populate_from_matlab(session=session)
+
+        self.assertEqual(events.to_dataframe().shape, (7695, 3))
+        self.assertEqual(actions.to_dataframe().shape, (251, 3))
+        self.assertEqual(states.to_dataframe().shape, (612, 3))
+        self.assertEqual(trials.to_dataframe().shape, (153, 10))
+        # the events of the second trial are offset by the start time of the trial
+        self.assertAlmostEqual(events['timestamp'][int(session.events['index'][0])],
+                               session.trial_start_offset[1] + session.events['timestamp'][session.events['index'][0]])
+
+    def test_populate_trial_relative_timestamps(self):
+        session = BeadlSession.from_matlab(self.beadl_data)
+        event_types = EventTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        events = EventsTable(description="description", event_types_table=event_types)
+        events.populate_from_matlab(session=session)
+        relative_events = EventsTable(description="description", event_types_table=event_types,
+                                      timestamp_reference="trial_start_time")
+        relative_events.populate_from_matlab(session=session)
+
+        action_types = ActionTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                        populate_from_program=True)
+        actions = ActionsTable(description="description", action_types_table=action_types,
+                               timestamp_reference="trial_start_time")
+        actions.populate_from_matlab(session=session)
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.populate_from_matlab(session=session)
+        trials = TrialsTable(description="description", states_table=states, events_table=relative_events,
+                             actions_table=actions)
+        trials.populate_from_matlab(session=session)
+
+        self.assertEqual(np.asarray(relative_events['timestamp'].data).dtype, np.float32)
+        np.testing.assert_array_equal(relative_events['timestamp'].data, session.events['timestamp'].astype(np.float32))
+        np.testing.assert_allclose(relative_events.get_absolute_timestamps(trials=trials),
+                                   events.get_absolute_timestamps(), rtol=0, atol=1e-4)
+        self.assertEqual(relative_events.query_time(start=100.0, stop=200.0, trials=trials, df=False),
+                         events.query_time(start=100.0, stop=200.0, df=False))
+        np.testing.assert_allclose(actions.get_absolute_timestamps(trials=trials),
+                                   session.actions['timestamp'] + session.row_offsets('actions'), rtol=0, atol=1e-4)
+        with self.assertRaises(ValueError):
+            relative_events.get_absolute_timestamps()
+
+    def test_append_trials_with_arguments(self):
+        session = BeadlSession.from_matlab(self.beadl_data)
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.populate_from_matlab(session=session)
+        event_types = EventTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        events = EventsTable(description="description", event_types_table=event_types)
+        events.populate_from_matlab(session=session)
+        action_types = ActionTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                        populate_from_program=True)
+        actions = ActionsTable(description="description", action_types_table=action_types)
+        actions.populate_from_matlab(session=session)
+        trials = TrialsTable(description="description", states_table=states, events_table=events, actions_table=actions)
+        trials.populate_from_matlab(session=session)
+
+        new_trial = dict(start_time=[5000.0], stop_time=[5001.0], num_states=[1], num_events=[0], num_actions=[0],
+                         states=dict(state_type=[0], start_time=[5000.0], stop_time=[5001.0]))
+        # the trials are checked before the states are added
+        with self.assertRaises(ValueError):
+            trials.append_trials(**new_trial)
+        self.assertEqual(len(states), 612)
+
+        arguments = {arg: trials[arg].data[-1:] for arg in session.arguments}
+        trials.append_trials(**new_trial, **arguments)
+        self.assertEqual(len(states), 613)
+        self.assertEqual(len(trials), 154)
+        self.assertEqual(trials.to_dataframe().shape, (154, 10))
+        self.assertEqual(trials.trial_states(trial=153, df=False), slice(612, 613))
+        for arg in session.arguments:
+            self.assertEqual(trials[arg].data[-1], trials[arg].data[-2])
+
+    def test_populate_trials_without_states(self):
+        # the second trial has no states
+        session = BeadlSession(trial_start_offset=[0.0, 10.0, 20.0],
+                               states=dict(start_time=np.array([0.0, 1.5, 0.0, 2.5]), index=np.array([2, 2, 4])),
+                               all_states=dict(), events=dict(index=np.array([0, 0, 0])),
+                               actions=dict(index=np.array([0, 0, 0])), arguments=dict())
+        trials = TrialsTable(description="description")
+        trials.populate_from_matlab(session=session)
+
+        np.testing.assert_array_equal(trials['stop_time'].data, [1.5, 10.0, 22.5])
+        self.assertEqual(list(trials.states_index.data), [2, 2, 4])
+
+    def test_populate_without_data(self):
+        event_types = EventTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        events = EventsTable(description="description", event_types_table=event_types)
+        with self.assertRaises(ValueError):
+            events.populate_from_matlab()
+
+    def test_session_decodes_columns_lazily(self):
+        session = BeadlSession.from_matlab(self.beadl_data)
+        self.assertNotIn('event_name', dict(session.events))
+
+        event_names = session.events['event_name']
+        self.assertIsInstance(event_names, pd.Categorical)
+        self.assertIn('event_name', dict(session.events))
+        self.assertEqual(list(event_names[:3]), ['CorrectPortPoke', 'CorrectPortPoke', 'stateTimer'])
+        self.assertEqual(session.events['timestamp'].dtype, np.float64)
+
+        # trials with a single action are loaded as a 0-d struct array
+        self.assertEqual(session.counts('actions').min(), 1)
+        self.assertEqual(session.actions['index'][-1], len(session.actions['action_name']))
+
+
+class TestTableMethods(TestCase):
+
+    def setUp(self):
+        with open(BEADL_TASK_SCHEMA_FILE, "r") as test_xsd_file:
+            test_xsd = test_xsd_file.read()
+
+        with open(BEADL_TASK_PROGRAM_FILE, "r") as test_xml_file:
+            test_xml = test_xml_file.read()
+
+        self.beadl_task_schema = BEADLTaskSchema(
+            name="beadl_task_schema",
+            data=test_xsd,
+            version="0.1.0",
+            language="XSD"  # TODO remove when no longer necessary
+        )
+
+        self.beadl_task_program = BEADLTaskProgram(
+            name="beadl_task_program",
+            data=test_xml,
+            schema=self.beadl_task_schema,
+            language="XML"  # TODO remove when no longer necessary
+        )
+
+        self.event_types = EventTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                           populate_from_program=True)
+        self.action_types = ActionTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                             populate_from_program=True)
+
+    def test_events_add_rows(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        events.add_event(event_type=0, timestamp=0.1, value="on")
+        events.add_rows(timestamp=np.array([0.4, 0.5]), event_type=np.array([1, 0]), value=np.array(["on", "off"]))
+
+        self.assertEqual(len(events), 3)
+        self.assertEqual(events.id.data, [0, 1, 2])
+        self.assertEqual(events['timestamp'].data, [0.1, 0.4, 0.5])
+        self.assertEqual(events['event_type'].data, [0, 1, 0])
+        self.assertEqual(events['value'].data, ["on", "on", "off"])
+
+    def test_actions_add_rows_with_duration(self):
+        actions = ActionsTable(description="description", action_types_table=self.action_types)
+        actions.add_rows(timestamp=[0.4, 0.5], action_type=[1, 0], value=["open", "close"], duration=[0.1, 0.2])
+        actions.add_action(action_type=0, timestamp=0.6, duration=0.3, value="open")
+
+        self.assertEqual(actions.colnames, ("timestamp", "action_type", "value", "duration"))
+        self.assertEqual(actions['duration'].data, [0.1, 0.2, 0.3])
+        with self.assertRaises(ValueError):
+            actions.add_rows(timestamp=[0.7], action_type=[0], value=["open"])
+
+    def test_states_add_rows(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.add_rows(state_type=[0, 1], start_time=[0.0, 0.1], stop_time=[0.1, 0.2])
+
+        self.assertEqual(states['state_type'].data, [0, 1])
+        self.assertEqual(states['start_time'].data, [0.0, 0.1])
+        self.assertEqual(states['stop_time'].data, [0.1, 0.2])
+
+    def test_generate_state_end_times(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        # the first trial ends with the End state and the second trial is cut off after the Reward state
+        end_times = states._generate_state_end_times(
+            state_names=np.array(["WaitForPoke", "Reward", "End", "WaitForPoke", "Reward"], dtype=object),
+            start_times=np.array([0.0, 0.5, 1.0, 2.0, 2.5]),
+            trial_ids=np.array([0, 0, 0, 1, 1]))
+        np.testing.assert_array_equal(end_times, [0.5, 1.0, 1.0, 2.5, 2.5])
+
+    def test_trials_add_trials(self):
+        trials = TrialsTable(description="description")
+        trials.add_trial(start_time=0.0, stop_time=0.8, states=[0, 1], events=[0], actions=[0])
+        trials.add_trials(start_time=[1.0, 2.0], stop_time=[1.8, 2.8],
+                          num_states=[3, 1], num_events=[2, 0], num_actions=[1, 1])
+
+        self.assertEqual(trials.colnames, ("start_time", "stop_time", "states", "events", "actions"))
+        self.assertEqual(trials.id.data, [0, 1, 2])
+        self.assertEqual(trials['start_time'].data, [0.0, 1.0, 2.0])
+        self.assertEqual(trials.states_index.data, [2, 5, 6])
+        self.assertEqual(trials.states.data, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(trials.events_index.data, [1, 3, 3])
+        self.assertEqual(trials.events.data, [0, 1, 2])
+        self.assertEqual(trials.actions.data, [0, 1, 2])
+        with self.assertRaises(ValueError):
+            trials.add_trials(start_time=[3.0], stop_time=[3.8], num_states=[1])
+        with self.assertRaisesWith(ValueError, "'reward' is not a column of trials."):
+            trials.add_trials(start_time=[3.0], stop_time=[3.8], num_states=[1], num_events=[0], num_actions=[0],
+                              reward=[1])
+
+    def test_trial_rows(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        events.add_rows(timestamp=[0.1, 0.4, 1.1, 1.2, 1.5], event_type=[0, 1, 0, 1, 0],
+                        value=["on", "off", "on", "off", "on"])
+        trials = TrialsTable(description="description", events_table=events)
+        trials.add_trials(start_time=[0.0, 1.0], stop_time=[0.8, 1.8], num_events=[2, 3])
+
+        events_slice = trials.trial_events(trial=1, df=False)
+        self.assertEqual(events_slice, slice(2, 5))
+        timestamps = np.asarray(events['timestamp'].data)
+        np.testing.assert_array_equal(timestamps[events_slice], [1.1, 1.2, 1.5])
+        self.assertEqual(list(trials.trial_events(trial=0)['timestamp']), [0.1, 0.4])
+
+        self.assertEqual(trials.trial_events(trial=0, stop=2, df=False), slice(0, 5))
+        self.assertEqual(trials.trial_events(trial=1, stop=1, df=False), slice(0, 0))
+        with self.assertRaises(ValueError):
+            trials.trial_events(trial=2)
+        with self.assertRaises(ValueError):
+            trials.trial_events(trial=1, stop=3)
+        with self.assertRaises(ValueError):
+            trials.trial_states(trial=0)
+
+        # the rows of a trial need not be contiguous when trials are added with add_trial
+        trials = TrialsTable(description="description", events_table=events)
+        trials.add_trial(start_time=0.0, stop_time=0.8, states=[], events=[4, 0], actions=[])
+        np.testing.assert_array_equal(trials.trial_events(trial=0, df=False), [4, 0])
+        self.assertEqual(trials.trial_actions(trial=0, df=False), slice(0, 0))
+
+    def test_types_table_encode(self):
+        names = list(self.event_types['event_name'].data)
+        codes = self.event_types.encode([names[2], names[0], names[2]])
+        np.testing.assert_array_equal(codes, [2, 0, 2])
+
+        # the mapping stays current when a type is added after the first encode
+        self.event_types.add_row(event_name="NewEvent")
+        np.testing.assert_array_equal(self.event_types.encode(["NewEvent", names[1]]), [len(names), 1])
+
+        with self.assertRaises(ValueError):
+            self.event_types.encode(["UnknownEvent"])
+
+        # the arguments of add_row are checked before the row is added
+        with self.assertRaisesRegex(TypeError, "incorrect type for 'id'"):
+            self.event_types.add_row(event_name="BadEvent", id="1")
+        self.assertEqual(len(self.event_types), len(names) + 1)
+        # the row can be passed as a dict, the same as DynamicTable.add_row
+        self.event_types.add_row({"event_name": "DictEvent"})
+        np.testing.assert_array_equal(self.event_types.encode(["DictEvent"]), [len(names) + 1])
+
+    def test_add_rows_out_of_bounds(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        with self.assertRaises(ValueError):
+            events.add_rows(timestamp=[0.4, 0.5], event_type=[0, len(self.event_types)], value=["on", "off"])
+        with self.assertRaises(ValueError):
+            events.add_rows(timestamp=[0.4], event_type=[0, 1], value=["on", "off"])
+        self.assertEqual(len(events), 0)
+
+    def test_to_categorical_dataframe(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        events.add_rows(timestamp=[0.1, 0.4, 0.5], event_type=[2, 0, 2], value=["on", "off", "on"])
+        df = events.to_categorical_dataframe()
+
+        names = list(self.event_types['event_name'].data)
+        self.assertEqual(list(df.columns), ["timestamp", "event_type", "value"])
+        self.assertEqual(list(df.index), [0, 1, 2])
+        self.assertIsInstance(df['event_type'].dtype, pd.CategoricalDtype)
+        self.assertEqual(list(df['event_type'].cat.categories), names)
+        self.assertEqual(list(df['event_type']), [names[2], names[0], names[2]])
+        np.testing.assert_array_equal(df['event_type'].cat.codes, [2, 0, 2])
+        self.assertEqual(list(df['value']), ["on", "off", "on"])
+
+    def test_configure_dataio_invalid_columns(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        events.add_rows(timestamp=[0.1, 0.4], event_type=[2, 0], value=["on", "off"])
+        events.configure_dataio(columns=["timestamp"])
+        with self.assertRaises(ValueError):
+            events.configure_dataio(columns=["timestamp"])
+        with self.assertRaises(ValueError):
+            events.configure_dataio(columns=["duration"])
+
+    def test_encode_values(self):
+        events = EventsTable(description="description", event_types_table=self.event_types, encode_values=True)
+        events.add_event(event_type=0, timestamp=0.1, value="on")
+        events.add_rows(timestamp=[0.4, 0.5, 0.9], event_type=[1, 0, 1], value=["off", "on", "in"])
+
+        self.assertEqual(events.colnames, ("timestamp", "event_type", "value"))
+        self.assertIsInstance(events['value'], EnumData)
+        self.assertEqual(events['value'].elements.data, ["on", "off", "in"])
+        self.assertEqual(list(events['value'].data), [0, 1, 0, 2])
+        self.assertEqual(list(events.to_dataframe()['value']), ["on", "off", "on", "in"])
+        df = events.to_categorical_dataframe()
+        self.assertEqual(list(df['value'].cat.categories), ["on", "off", "in"])
+        self.assertEqual(list(df['value']), ["on", "off", "on", "in"])
+        # a single row after add_rows uses the same elements
+        events.add_event(event_type=0, timestamp=1.0, value="off")
+        self.assertEqual(events['value'].elements.data, ["on", "off", "in"])
+        self.assertEqual(list(events['value'].data), [0, 1, 0, 2, 1])
+
+    def test_query_time(self):
+        events = EventsTable(description="description", event_types_table=self.event_types)
+        events.add_rows(timestamp=[0.1, 0.4, 0.5, 0.9], event_type=[0, 1, 0, 1], value=["on", "off", "on", "off"])
+
+        self.assertEqual(events.query_time(start=0.4, stop=0.9, df=False), slice(1, 3))
+        np.testing.assert_array_equal(events.query_time(start=0.4, stop=0.9).index, [1, 2])
+        self.assertEqual(len(events.query_time(start=2.0, stop=3.0)), 0)
+
+        # the time index is rebuilt for new rows, which need not be in order
+        events.add_event(event_type=0, timestamp=0.45, value="on")
+        np.testing.assert_array_equal(events.query_time(start=0.4, stop=0.9, df=False), [1, 2, 4])
+        self.assertEqual(list(events.query_time(start=0.4, stop=0.9)['value']), ["off", "on", "on"])
+
 
 class TestPlot(TestCase):
 
@@ -300,6 +1010,152 @@ class TestPlot(TestCase):
         self.events = EventsTable(description="description", event_types_table=self.event_types)
         self.events.populate_from_matlab(data_path=self.beadl_data)
 
+    def test_plot_trials_range(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.populate_from_matlab(data_path=self.beadl_data)
+        trials = TrialsTable(description="description", states_table=states, events_table=self.events,
+                             actions_table=self.actions)
+        trials.populate_from_matlab(data_path=self.beadl_data)
+
+        fig = plot_trials(trials, states, state_types, self.actions, self.action_types, self.events, self.event_types,
+                          trial_range=(2, 7))
+        events_rows = trials.trial_events(trial=2, stop=7, df=False)
+        np.testing.assert_array_equal(fig.axes[0].collections[0].get_offsets()[:, 0],
+                                      np.asarray(self.events['timestamp'].data)[events_rows])
+        np.testing.assert_array_equal(fig.axes[0].get_xticks(), trials['start_time'].data[2:7])
+        plt.close(fig)
+
+        # the same trials of a DataFrame
+        fig = plot_trials(trials[0:10], states, state_types, self.actions, self.action_types, self.events,
+                          self.event_types, trial_range=(2, 7))
+        np.testing.assert_array_equal(fig.axes[0].get_xticks(), trials['start_time'].data[2:7])
+        plt.close(fig)
+
+    def test_plot_events_density(self):
+        fig = plot_events(self.events, self.event_types, max_markers=1000, num_bins=50)
+        mesh = fig.axes[0].collections[0]
+        self.assertIsInstance(mesh, matplotlib.collections.QuadMesh)
+        self.assertEqual(mesh.get_array().sum(), len(self.events))
+        plt.close(fig)
+
+        fig = plt.figure()
+        markers = plot_markers([0.0, 1.0, 2.0], [0, 1, 1], max_markers=3)
+        self.assertIsInstance(markers, matplotlib.collections.PathCollection)
+        mesh = plot_markers([0.0, 1.0, 2.0, 2.0], [0, 1, 1, 1], max_markers=3, num_bins=2)
+        np.testing.assert_array_equal(mesh.get_array().filled(0), [[1, 0], [0, 3]])
+        plt.close(fig)
+
+    def test_compute_state_transition_matrix(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.add_rows(state_type=[0, 1, 2, 0, 2, 1], start_time=[0.0, 0.1, 0.2, 1.0, 1.1, 1.2],
+                        stop_time=[0.1, 0.2, 0.3, 1.1, 1.2, 1.3])
+        trials = TrialsTable(description="description", states_table=states)
+        trials.add_trials(start_time=[0.0, 1.0], stop_time=[0.5, 1.5], num_states=[3, 3])
+        trials.add_column(name="block", description="block", data=["a", "b"])
+        num_states = len(state_types)
+
+        counts, probabilities = compute_state_transition_matrix(states, state_types)
+        self.assertEqual(counts.values.sum(), 5)
+        self.assertEqual(counts.iloc[2, 0], 1)  # the transition across the trials
+        np.testing.assert_array_equal(probabilities.values.sum(axis=1)[:3], [1, 1, 1])
+
+        counts, probabilities = compute_state_transition_matrix(states, state_types, trials=trials)
+        self.assertEqual(counts.values.sum(), 4)
+        self.assertEqual(counts.iloc[2, 0], 0)
+        self.assertEqual(probabilities.iloc[0, 1], 0.5)
+
+        blocks = compute_state_transition_matrix(states, state_types, trials=trials, blocks="block", sparse=True)
+        self.assertEqual(list(blocks), ["a", "b"])
+        block_counts, block_probabilities = blocks["b"]
+        self.assertEqual(block_counts.shape, (num_states, num_states))
+        self.assertEqual(block_counts.nnz, 2)
+        self.assertEqual(block_counts[0, 2], 1)
+        self.assertEqual(block_probabilities[2, 1], 1.0)
+        with self.assertRaises(ValueError):
+            compute_state_transition_matrix(states, state_types, blocks="block")
+
+    def test_compute_state_ngrams(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        names = state_types['state_name'][:]
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.add_rows(state_type=[0, 1, 2, 0, 1, 2, 0], start_time=[0.0, 0.1, 0.2, 1.0, 1.1, 1.2, 1.3],
+                        stop_time=[0.1, 0.2, 0.3, 1.1, 1.2, 1.3, 1.4])
+        trials = TrialsTable(description="description", states_table=states)
+        trials.add_trials(start_time=[0.0, 1.0], stop_time=[0.5, 1.5], num_states=[3, 4])
+
+        bigrams = compute_state_ngrams(states, state_types, n=2)
+        counts, _ = compute_state_transition_matrix(states, state_types)
+        self.assertEqual(bigrams, {(f, t): c for (f, t), c in counts.stack().items() if c > 0})
+
+        trigrams = compute_state_ngrams(states, state_types, n=3)
+        self.assertEqual(trigrams[(names[0], names[1], names[2])], 2)
+        self.assertEqual(sum(trigrams.values()), 5)
+        trigrams = compute_state_ngrams(states, state_types, n=3, trials=trials)
+        self.assertEqual(trigrams, {(names[0], names[1], names[2]): 2, (names[1], names[2], names[0]): 1})
+        per_trial = compute_state_ngrams(states, state_types, n=3, trials=trials, per_trial=True)
+        self.assertEqual(per_trial, {0: {(names[0], names[1], names[2]): 1},
+                                     1: {(names[0], names[1], names[2]): 1, (names[1], names[2], names[0]): 1}})
+
+        num_states = len(state_types)
+        matrix = compute_state_ngrams(states, state_types, n=3, trials=trials, sparse=True)
+        self.assertEqual(matrix.shape, (num_states ** 2, num_states))
+        self.assertEqual(matrix[0 * num_states + 1, 2], 2)
+        matrix = compute_state_ngrams(states, state_types, n=3, trials=trials, per_trial=True, sparse=True)
+        self.assertEqual(matrix.shape, (2, num_states ** 3))
+        self.assertEqual(matrix.sum(axis=1).tolist(), [[1], [2]])
+        with self.assertRaises(ValueError):
+            compute_state_ngrams(states, state_types, per_trial=True)
+
+    def test_plot_state_transition_graph(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.populate_from_matlab(data_path=self.beadl_data)
+        counts, probabilities = compute_state_transition_matrix(states, state_types)
+
+        clear_layout_cache()
+        fig = plot_state_transition_graph(probabilities)
+        labels = [text.get_text() for text in fig.axes[0].texts]
+        self.assertEqual(len(labels), len(state_types) + np.count_nonzero(probabilities.values))
+        positions = {text.get_text(): text.get_position() for text in fig.axes[0].texts[:len(state_types)]}
+        plt.close(fig)
+
+        # the layout of the same states is reused, and edges at or below the threshold are not drawn
+        with mock.patch("networkx.planar_layout") as planar_layout:
+            fig = plot_state_transition_graph(counts, threshold=10)
+            planar_layout.assert_not_called()
+        self.assertEqual(len(fig.axes[0].texts), len(state_types) + np.count_nonzero(counts.values > 10))
+        self.assertEqual({text.get_text(): text.get_position() for text in fig.axes[0].texts[:len(state_types)]},
+                         positions)
+        plt.close(fig)
+        clear_layout_cache()
+
+    def test_state_transition_accumulator(self):
+        state_types = StateTypesTable(description="description", beadl_task_program=self.beadl_task_program,
+                                      populate_from_program=True)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.add_state(state_type=0, start_time=0.0, stop_time=0.1)
+        accumulator = StateTransitionAccumulator(state_types=state_types, states=states)
+        states.add_state(state_type=1, start_time=0.1, stop_time=0.2)
+        states.add_rows(state_type=[2, 0, 1], start_time=[0.2, 0.3, 0.4], stop_time=[0.3, 0.4, 0.5])
+
+        counts, probabilities = accumulator.get_matrices()
+        expected_counts, expected_probabilities = compute_state_transition_matrix(states, state_types)
+        pd.testing.assert_frame_equal(counts, expected_counts)
+        pd.testing.assert_frame_equal(probabilities, expected_probabilities)
+
+        accumulator.end_sequence()
+        states.add_state(state_type=2, start_time=1.0, stop_time=1.1)
+        self.assertEqual(accumulator.counts[1, 2], 1)
+        accumulator.detach()
+        states.add_state(state_type=0, start_time=1.1, stop_time=1.2)
+        self.assertEqual(accumulator.counts.sum(), 4)
+
     def test_events_show_by_type_and_value(self):
         y_values, y_tick_labels, y_label = show_by_type_and_value(table=self.events, table_types=self.event_types)
 
@@ -309,6 +1165,21 @@ class TestPlot(TestCase):
                                          "CorrectPortPoke(in)",
                                          "stateTimer(expired)"]))
 
+    def test_show_by_type_and_value_order(self):
+        y_values, y_tick_labels, _ = show_by_type_and_value(table=self.events, table_types=self.event_types, y_offset=2)
+        # the labels are ordered by type index and then by value
+        event_names = self.event_types['event_name'][:]
+        expected = sorted(set(zip(self.events['event_type'].data, self.events['value'].data)))
+        self.assertEqual(y_tick_labels, ["%s(%s)" % (event_names[t], v) for t, v in expected])
+        labels = np.asarray(y_tick_labels)[np.asarray(y_values) - 2]
+        first_labels = ["%s(%s)" % (event_names[self.events['event_type'].data[i]], self.events['value'].data[i])
+                        for i in range(3)]
+        np.testing.assert_array_equal(labels[:3], first_labels)
+        # a DataFrame gives the same labels
+        df_values, df_labels, _ = show_by_type_and_value(table=self.events[0:100], table_types=self.event_types,
+                                                         y_offset=2)
+        self.assertEqual(list(labels[:100]), list(np.asarray(df_labels)[df_values - 2]))
+
     def test_events_show_by_type(self):
         y_values, y_tick_labels, y_label = show_by_type_and_value(table=self.events, table_types=self.event_types, show_table_values=False)
 
@@ -417,4 +1288,122 @@ class TestTaskSeriesRoundtrip(TestCase):
             self.assertContainerEqual(recording, read_nwbfile.get_acquisition("task_recording"))
             self.assertContainerEqual(actions, read_nwbfile.get_acquisition("task_recording").actions)
             self.assertContainerEqual(events, read_nwbfile.get_acquisition("task_recording").events)
-            self.assertContainerEqual(states, read_nwbfile.get_acquisition("task_recording").states)
\ No newline at end of file
+            self.assertContainerEqual(states, read_nwbfile.get_acquisition("task_recording").states)
+
+    def _write_recording(self, actions_kwargs=None, configure=None, action_values=("open", "close")):
+        """
+        Write a TaskRecording with two trials and return the TaskRecording and TrialsTable.
+
+        actions_kwargs: Extra arguments of the ActionsTable
+        action_values: The values of the two actions
+        configure: Function called with the EventsTable, ActionsTable and StatesTable before they are written
+        """
+        with open(BEADL_TASK_SCHEMA_FILE, "r") as test_xsd_file:
+            test_xsd = test_xsd_file.read()
+        with open(BEADL_TASK_PROGRAM_FILE, "r") as test_xml_file:
+            test_xml = test_xml_file.read()
+        task_schema = BEADLTaskSchema(name="task_schema", data=test_xsd, version="0.1.0", language="XSD")
+        task_program = BEADLTaskProgram(name="task_program", data=test_xml, schema=task_schema, language="XML")
+        action_types = ActionTypesTable(description="description", beadl_task_program=task_program,
+                                        populate_from_program=True)
+        event_types = EventTypesTable(description="description", beadl_task_program=task_program,
+                                      populate_from_program=True)
+        state_types = StateTypesTable(description="description", beadl_task_program=task_program,
+                                      populate_from_program=True)
+        self.nwbfile.add_lab_meta_data(Task(
+            task_program=task_program,
+            task_schema=task_schema,
+            event_types=event_types,
+            state_types=state_types,
+            action_types=action_types,
+            task_arguments=TaskArgumentsTable(beadl_task_program=task_program, populate_from_program=True),
+        ))
+
+        actions = ActionsTable(description="description", action_types_table=action_types, **(actions_kwargs or {}))
+        actions.add_rows(action_type=[0, 1], timestamp=[0.4, 0.5], duration=[0.1, 0.1],
+                         value=list(action_values))
+        events = EventsTable(description="description", event_types_table=event_types)
+        events.add_rows(event_type=[0, 1, 1, 0], timestamp=[0.4, 0.5, 1.4, 1.5], duration=[0.1] * 4, value=["on"] * 4)
+        states = StatesTable(description="description", state_types_table=state_types)
+        states.add_rows(state_type=[0, 1, 0, 1], start_time=[0.0, 0.1, 1.0, 1.1], stop_time=[0.1, 0.2, 1.1, 1.2])
+        trials = TrialsTable(description="description", states_table=states, events_table=events, actions_table=actions)
+        trials.add_trials(start_time=[0.0, 1.0], stop_time=[0.8, 1.8], num_states=[2, 2], num_events=[2, 2],
+                          num_actions=[1, 1])
+        if configure is not None:
+            configure(events, actions, states)
+
+        recording = TaskRecording(actions=actions, states=states, events=events)
+        self.nwbfile.add_acquisition(recording)
+        self.nwbfile.trials = trials
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+        return recording, trials
+
+    def test_roundtrip_configure_dataio(self):
+        def configure(events, actions, states):
+            events.configure_dataio(columns={"timestamp": dict(), "value": dict(compression_opts=9)})
+            states.configure_dataio(chunk_rows=4, compression=False)
+        recording, _ = self._write_recording(configure=configure)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_recording = io.read().get_acquisition("task_recording")
+            self.assertContainerEqual(recording, read_recording)
+            timestamp = read_recording.events['timestamp'].data
+            self.assertEqual(timestamp.chunks, (4,))
+            self.assertEqual(timestamp.maxshape, (None,))
+            self.assertEqual(timestamp.compression, "gzip")
+            self.assertTrue(timestamp.shuffle)
+            self.assertEqual(read_recording.events['value'].data.compression_opts, 9)
+            self.assertIsNone(read_recording.events['event_type'].data.compression)
+            self.assertEqual(read_recording.states['start_time'].data.chunks, (4,))
+            self.assertIsNone(read_recording.states['start_time'].data.compression)
+            self.assertIsNone(read_recording.actions['timestamp'].data.chunks)
+
+    def test_roundtrip_encoded_values(self):
+        recording, _ = self._write_recording(actions_kwargs=dict(encode_values=True))
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_actions = io.read().get_acquisition("task_recording").actions
+            self.assertContainerEqual(recording.actions, read_actions)
+            self.assertIsInstance(read_actions['value'], EnumData)
+            self.assertEqual(list(read_actions['value'].data[:]), [0, 1])
+            self.assertEqual(list(read_actions.to_categorical_dataframe()["value"]), ["open", "close"])
+            self.assertEqual(list(read_actions.to_dataframe()["value"]), ["open", "close"])
+
+    def test_roundtrip_encoded_values_dataframe(self):
+        # the same value twice is stored as the codes [0, 0], which are not increasing
+        recording, _ = self._write_recording(actions_kwargs=dict(encode_values=True), action_values=("open", "open"))
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_actions = io.read().get_acquisition("task_recording").actions
+            self.assertEqual(list(read_actions['value'].data[:]), [0, 0])
+            df = read_actions.to_dataframe()
+            self.assertEqual(list(df.columns), list(recording.actions.to_dataframe().columns))
+            self.assertEqual(list(df["value"]), ["open", "open"])
+            self.assertEqual(list(read_actions.to_dataframe(exclude={"duration"})["value"]), ["open", "open"])
+            self.assertEqual(list(read_actions.get(slice(0, 2), index=False)["value"]), ["open", "open"])
+            self.assertEqual(read_actions.get(1, index=False)["value"].iloc[0], "open")
+            self.assertEqual(list(read_actions[0:2]["value"]), [0, 0])
+
+    def test_roundtrip_relative_timestamps(self):
+        recording, _ = self._write_recording(actions_kwargs=dict(timestamp_reference="trial_start_time"))
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_nwbfile = io.read()
+            read_recording = read_nwbfile.get_acquisition("task_recording")
+            self.assertContainerEqual(recording.actions, read_recording.actions)
+            self.assertEqual(read_recording.actions.timestamp_reference, "trial_start_time")
+            self.assertEqual(read_recording.events.timestamp_reference, "session_start_time")
+            # the actions at 0.4 and 0.5 s after the start of the trials at 0 and 1 s
+            np.testing.assert_allclose(read_recording.actions.get_absolute_timestamps(trials=read_nwbfile.trials),
+                                       [0.4, 1.5])
+            self.assertEqual(read_recording.actions.query_time(start=1.0, stop=2.0, trials=read_nwbfile.trials,
+                                                               df=False), slice(1, 2))
+
+    def test_roundtrip_query_time(self):
+        self._write_recording()
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_events = io.read().get_acquisition("task_recording").events
+            self.assertEqual(read_events.query_time(start=0.45, stop=1.45, df=False), slice(1, 3))
+            np.testing.assert_array_equal(read_events.query_time(start=0.45, stop=1.45)['timestamp'], [0.5, 1.4])
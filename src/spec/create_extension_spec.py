@@ -301,12 +301,22 @@ def main():
         neurodata_type_def='EventsTable',
         neurodata_type_inc='DynamicTable',
         doc=('A column-based table to store information about events, one event per row.'),
+        attributes=[
+            NWBAttributeSpec(
+                name='timestamp_reference',
+                doc=('The time the timestamps are relative to. Either "session_start_time" or "trial_start_time", '
+                     'i.e., the start_time of the trial of the event in the TrialsTable.'),
+                dtype='text',
+                default_value='session_start_time',
+                required=False
+            ),
+        ],
         datasets=[
             NWBDatasetSpec(
                 name='timestamp',
                 neurodata_type_inc='VectorData',
                 dtype='float32',
-                doc=('The time that the event occurred, in seconds.'),
+                doc=('The time that the event occurred, in seconds, relative to the timestamp_reference.'),
             ),
             NWBDatasetSpec(
                 name='event_type',
@@ -317,8 +327,17 @@ def main():
             NWBDatasetSpec(
                 name='value',
                 neurodata_type_inc='VectorData',
+                doc=('The value of the event. This is either the text of each value or, as an EnumData, the '
+                     'index of each value in value_elements. The dtype is not constrained so that the column can hold '
+                     'either form. It is text if value_elements is absent and unsigned integer codes if '
+                     'value_elements is present.'),
+            ),
+            NWBDatasetSpec(
+                name='value_elements',
+                neurodata_type_inc='VectorData',
                 dtype='text',
-                doc=('The value of the event'),
+                doc=('The unique values of the events if the value column is stored as an EnumData.'),
+                quantity='?',
             ),
         ]
     )
@@ -328,12 +347,22 @@ def main():
         neurodata_type_def='ActionsTable',
         neurodata_type_inc='DynamicTable',
         doc=('A column-based table to store information about actions, one action per row.'),
+        attributes=[
+            NWBAttributeSpec(
+                name='timestamp_reference',
+                doc=('The time the timestamps are relative to. Either "session_start_time" or "trial_start_time", '
+                     'i.e., the start_time of the trial of the action in the TrialsTable.'),
+                dtype='text',
+                default_value='session_start_time',
+                required=False
+            ),
+        ],
         datasets=[
             NWBDatasetSpec(
                 name='timestamp',
                 neurodata_type_inc='VectorData',
                 dtype='float32',
-                doc=('The time that the action occurred, in seconds.'),
+                doc=('The time that the action occurred, in seconds, relative to the timestamp_reference.'),
             ),
             NWBDatasetSpec(
                 name='action_type',
@@ -344,8 +373,17 @@ def main():
             NWBDatasetSpec(
                 name='value',
                 neurodata_type_inc='VectorData',
+                doc=('The value of the action. This is either the text of each value or, as an EnumData, the '
+                     'index of each value in value_elements. The dtype is not constrained so that the column can hold '
+                     'either form. It is text if value_elements is absent and unsigned integer codes if '
+                     'value_elements is present.'),
+            ),
+            NWBDatasetSpec(
+                name='value_elements',
+                neurodata_type_inc='VectorData',
                 dtype='text',
-                doc=('The value of the action'),
+                doc=('The unique values of the actions if the value column is stored as an EnumData.'),
+                quantity='?',
             ),
         ]
     )